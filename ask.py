@@ -8,8 +8,8 @@ Usage:
 ask [<msg>] [--yes=<reply_yes>] [--no=<reply_no>] [--engine=<tts-engine>]
 
 Options:
-    --engine=<str> TTS-engine to use {'google', 'espeak', 'festival'}
-                   [default: espeak]
+    --engine=<str> TTS-engine to use {'google', 'espeak', 'espeak-lib', 'festival'}
+                   (default: espeak-lib, espeak or another offline engine)
     --no=<str>     Message for negative answer
     --yes=<str>    Message for positive answer
     -h, --help     Print this
@@ -21,8 +21,9 @@ Examples:
 """
 import logging
 import sys
+import time
 from docopt import docopt
-from say import available_engines, ENGINE_DEFAULT, __version__, say
+from say import asay, available_engines, default_engine, __version__, speak, prefetch, speak_reply, discard_prefetched
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -70,20 +71,77 @@ class _GetchWindows:
 
 getch = _Getch()
 
-def ask(question,reply_y,reply_n,engine=ENGINE_DEFAULT):
+def ask(question,reply_y,reply_n,engine=None):
     """
+    both replies are synthesized in the background while the question is
+    spoken, so the chosen one plays right after the keypress.
     """
-    say(msg,engine)
+    for reply in (reply_y, reply_n):
+        if reply:
+            prefetch(reply,engine)
+    speak(question,engine)
     uinp = getch()
+    t_answer = time.perf_counter()
+    logger.debug("answer was : {}".format(uinp))
+    try:
+        if uinp in ['y','Y','j','J']:
+            if reply_y:
+                speak_reply(reply_y,engine,t_answer)
+                return 0
+        else:
+            if reply_n:
+                speak_reply(reply_n,engine,t_answer)
+            return 1
+    finally:
+        discard_prefetched()
+
+
+async def _agetch(timeout=None):
+    """
+    reads a single character from stdin without blocking the event loop.
+    returns None on timeout. unix only.
+    """
+    import asyncio, termios, tty
+    loop = asyncio.get_running_loop()
+    fd = sys.stdin.fileno()
+    old_settings = termios.tcgetattr(fd)
+    fut = loop.create_future()
+    def on_readable():
+        if not fut.done():
+            fut.set_result(sys.stdin.read(1))
+    try:
+        tty.setcbreak(fd)
+        loop.add_reader(fd, on_readable)
+        return await asyncio.wait_for(fut, timeout)
+    except asyncio.TimeoutError:
+        return None
+    finally:
+        loop.remove_reader(fd)
+        termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
+
+
+async def aask(question,reply_y,reply_n,engine=None,timeout=None):
+    """
+    async version of ask(). the question is spoken while already waiting for
+    the answer. no answer within timeout seconds counts as "no".
+    returns 0 (yes) or 1 (no).
+    """
+    import asyncio
+    asked = asyncio.ensure_future(asay(question,engine))
+    try:
+        uinp = await _agetch(timeout)
+    finally:
+        if not asked.done():
+            asked.cancel() # answered before the question was finished
+        await asyncio.gather(asked, return_exceptions=True)
     logger.debug("answer was : {}".format(uinp))
     if uinp in ['y','Y','j','J']:
         if reply_y:
-            say(reply_y,engine)
-            return 0
-    else:
-        if reply_n:
-            say(reply_n,engine)
-        return 1
+            await asay(reply_y,engine)
+        return 0
+    if reply_n:
+        await asay(reply_n,engine)
+    return 1
 
 
 if __name__ == '__main__':
@@ -95,7 +153,7 @@ if __name__ == '__main__':
     reply_n = kwargs['--no']
     engine = kwargs['--engine']
     if not engine in available_engines():
-        engine=ENGINE_DEFAULT
+        engine=default_engine()
     if not msg:
         msg = input("what should i ask? : ".format(msg))
 
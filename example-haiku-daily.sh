@@ -1,5 +1,6 @@
 #!/bin/bash
 export PATH=${PATH}:$(dirname $0)
-msg=$(haiku.py | tr -s '\n' ' ')
+# seeded with the date: the same haiku all day, a new one tomorrow
+msg=$(haiku.py --seed $(date +%F) --format line)
 echo $msg
 echo $msg | say --engine google
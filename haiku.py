@@ -2,12 +2,41 @@
 """
 generates a kind of haiku (usually 5-7-5 "syllables")
 
+every combination of the word lists has an index. a batch walks the indices
+in the order of a seeded affine permutation, so no haiku repeats until all
+of them were used - no rejection sampling, no memory of what was drawn.
+
+Usage:
+haiku.py [-n <n>] [--seed=<seed>] [--format=<fmt>]
+haiku.py --bench [-n <n>] [--format=<fmt>]
+
+Options:
+    -n <n>           Number of haikus (default: 1, with --bench: all)
+    --seed=<seed>    Seed, the same seed gives the same haikus
+    --format=<fmt>   Output format {'text', 'line', 'jsonl'}. text prints
+                     three lines per haiku, line one line per haiku (for
+                     `say --follow`), jsonl a manifest for `say --render-to`
+                     [default: text]
+    --bench          Generate (and format) the haikus without printing them,
+                     report the rate
+    -h, --help       Print this
+
+Examples:
+    $ ./haiku.py
+    $ ./haiku.py -n 5 --format line | say --follow
+    $ ./haiku.py -n 1000 --seed 42 --format jsonl | say --render-to haikus/ --engine espeak
+
 **TODO**
 
 * https://en.wikipedia.org/wiki/Haiku
 * https://www.101computing.net/haiku-generator-in-python/
 """
-from random import randint
+import itertools
+import json
+import math
+import random
+import sys
+import time
 
 wordList1 = ["Amazing", "Breathtaking", "Enchanting", "Colourful", "Delightful", "Delicate", "Inspiring"]
 wordList2 = ["visions", "distance", "conscience", "process", "chaos", "brothers", "fathers", "mothers", "siblings", "sisters", "nowhere", "wormhole"]
@@ -17,16 +46,96 @@ wordList5 = ["scenery","season", "colours","lights","Spring","Winter","Summer","
 wordList6 = ["undeniable", "beautiful", "irreplaceable", "unbelievable", "irrevocable"]
 wordList7 = ["inspiration", "imagination", "wisdom", "thoughts"]
 
-wordIndex1=randint(0, len(wordList1)-1)
-wordIndex2=randint(0, len(wordList2)-1)
-wordIndex3=randint(0, len(wordList3)-1)
-wordIndex4=randint(0, len(wordList4)-1)
-wordIndex5=randint(0, len(wordList5)-1)
-wordIndex6=randint(0, len(wordList6)-1)
-wordIndex7=randint(0, len(wordList7)-1)
+WORD_LISTS = [wordList1, wordList2, wordList3, wordList4, wordList5, wordList6, wordList7]
+TOTAL = math.prod(len(words) for words in WORD_LISTS) # number of different haikus
+FORMATS = ('text', 'line', 'jsonl')
+
+# all possible lines, precomputed. the index of a haiku is the mixed-radix
+# number of its word indices (last list varies fastest), which is the same
+# as the mixed-radix number of its line indices.
+_LINES = [[" ".join(words) + "," for words in itertools.product(wordList1, wordList2)],
+          [" ".join(words) + "," for words in itertools.product(wordList3, wordList4, wordList5)],
+          [" ".join(words) + "." for words in itertools.product(wordList6, wordList7)]]
+_RADIX2 = len(_LINES[2])
+_RADIX12 = len(_LINES[1]) * _RADIX2
+
+
+def haiku(index, sep="\n"):
+    """returns haiku number index (0 <= index < TOTAL), lines joined by sep."""
+    assert(0 <= index < TOTAL)
+    first, rest = divmod(index, _RADIX12)
+    second, third = divmod(rest, _RADIX2)
+    return _LINES[0][first] + sep + _LINES[1][second] + sep + _LINES[2][third]
+
+
+def _permutation(rng):
+    """returns (a, c) of a random affine permutation i -> (a * i + c) % TOTAL."""
+    while True:
+        a = rng.randrange(1, TOTAL)
+        if math.gcd(a, TOTAL) == 1: # a is invertible mod TOTAL, so the map is a bijection
+            return a, rng.randrange(TOTAL)
+
+
+def indices(n=None, seed=None):
+    """
+    yields n (default: TOTAL) different haiku indices in random order.
+    raises ValueError if there aren't n different haikus.
+    """
+    if n is None:
+        n = TOTAL
+    if not 0 <= n <= TOTAL:
+        raise ValueError("there are only {} different haikus, not {}".format(TOTAL, n))
+    a, c = _permutation(random.Random(seed))
+    index = c
+    for i in range(n):
+        yield index
+        index = (index + a) % TOTAL
+
+
+def haikus(n=None, seed=None):
+    """yields n (default: all) different haikus, see indices()."""
+    for index in indices(n, seed):
+        yield haiku(index)
+
+
+def _format(index, fmt):
+    if fmt == 'text':
+        return haiku(index)
+    if fmt == 'line':
+        return haiku(index, " ")
+    # output names stay the same across runs, so `say --render-to` skips haikus already rendered
+    return '{{"text": {}, "output": "haiku-{:06d}"}}'.format(json.dumps(haiku(index, " ")), index)
+
+
+def main():
+    from docopt import docopt
+    kwargs = docopt(__doc__)
+    n = int(kwargs['-n']) if kwargs['-n'] else None
+    fmt = kwargs['--format']
+    if fmt not in FORMATS:
+        print("unknown format '{}'. use one of {}".format(fmt, FORMATS), file=sys.stderr)
+        return 1
+    if n is not None and not 0 <= n <= TOTAL:
+        print("-n must be between 0 and {} (the number of different haikus)".format(TOTAL), file=sys.stderr)
+        return 1
+    if kwargs['--bench']:
+        n = TOTAL if n is None else n
+        s = time.perf_counter()
+        for index in indices(n):
+            _format(index, fmt)
+        elapsed = time.perf_counter() - s
+        print("{} haikus ({}) in {:.3f}s: {:.0f} haikus/s".format(n, fmt, elapsed, n / elapsed))
+        return 0
+    seed = kwargs['--seed']
+    if seed is not None and seed.isdigit():
+        seed = int(seed) # same haikus as haikus(n, seed=42) from python
+    out = sys.stdout
+    for i, index in enumerate(indices(1 if n is None else n, seed)):
+        if i and fmt == 'text':
+            out.write("\n")
+        out.write(_format(index, fmt) + "\n")
+    return 0
 
-haiku = wordList1[wordIndex1] + " " + wordList2[wordIndex2] + ",\n"
-haiku = haiku + wordList3[wordIndex3] + " " + wordList4[wordIndex4] + " " + wordList5[wordIndex5]  + ",\n"
-haiku = haiku + wordList6[wordIndex6] + " " + wordList7[wordIndex7] + "."
 
-print(haiku)
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 import random
 from string import Template
-from say import available_engines, say
+from say import available_engines, say, say_many
 
 msg = 'Look Dave, I can see you\'re really upset about this.'
 msg_tpl = Template("Hi! I am tts-engine $engine, \
@@ -14,6 +14,7 @@ for engine in available_engines():
 engines = available_engines()
 if 'google' in engines:
     engines.remove('google')
-for word in (msg_tpl.substitute({'engine': 'crazy'}) + " " + msg).split():
-    print(word)
-    say(word, engines[random.randint(0, len(engines)-1)])
+words = (msg_tpl.substitute({'engine': 'crazy'}) + " " + msg).split()
+print(' '.join(words))
+report = say_many([(word, engines[random.randint(0, len(engines)-1)]) for word in words])
+print("{:.2f}s of audio spoken in {:.2f}s".format(report['duration'], report['wall']))
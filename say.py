@@ -4,11 +4,38 @@
 converts given text/phrase to speech (tts). supports different tts-engines.
 
 Usage:
-say [<msg>] [--engine=<tts-engine>]
+say [<msg>] [--engine=<tts-engine>] [--no-cache] [--no-daemon] [--no-wait] [--stream] [--priority=<level>] [--ttl=<s>] [--socket=<path>]
+say --follow [--engine=<tts-engine>] [--backpressure=<policy>] [--queue-size=<n>] [--no-cache] [--no-daemon] [--priority=<level>] [--socket=<path>]
+say --render-to=<dir> [<manifest>] [--engine=<tts-engine>] [--jobs=<n>]
+say --serve [--socket=<path>]
+say --worker [--listen=<addr>]
+say --cache-stats
 
 Options:
-    --engine=<str> TTS-engine to use {'google', 'espeak', 'festival'}
-                   [default: espeak]
+    --engine=<str> TTS-engine to use {'google', 'espeak', 'espeak-lib', 'festival'}
+                   (default: espeak-lib, espeak or another offline engine)
+    --no-cache     Always synthesize, neither read nor fill the audio cache
+    --cache-stats  Print hit/miss counters and size of the audio cache
+    --serve        Run as resident daemon speaking requests from a unix socket
+    --socket=<path>  Socket of the daemon (default: $SAY_SOCKET or $XDG_RUNTIME_DIR/say-<uid>.sock)
+    --worker       Render audio for other hosts instead of speaking. clients
+                   list their workers in SAY_WORKERS=host:port,...
+    --listen=<addr>  Address the worker listens on [default: 127.0.0.1:1315]
+    --no-daemon    Don't hand over to a running daemon, synthesize in-process
+    --no-wait      Return as soon as the daemon has queued the message
+    --priority=<level>  Priority in the queue of the daemon {'low', 'normal',
+                   'high', 'urgent'}. urgent messages interrupt less
+                   important ones [default: normal]
+    --ttl=<s>      Drop the message if the daemon couldn't start speaking
+                   it within s seconds (default: 300)
+    --stream       Speak long texts sentence by sentence, synthesizing ahead
+    --follow       Speak every line from stdin as it streams in (until EOF)
+    --backpressure=<policy>  What to do if lines arrive faster than they can
+                   be spoken {'block', 'drop-oldest', 'coalesce'} [default: block]
+    --queue-size=<n>  Lines pending at most in --follow mode [default: 8]
+    --render-to=<dir>  Render the prompts of the manifest (text or json-lines,
+                   default: stdin) into audio files in dir instead of speaking
+    --jobs=<n>     Number of rendering processes (default: number of cpus)
     -h, --help     Print this
     --version      Print version
 
@@ -16,13 +43,29 @@ Examples:
     $ say "Hello world!" --engine espeak
     $ say "Look Dave, I can see you're really upset about this." --engine espeak
     $ say "This tts-engine sounds more human but requires to be online." --engine google
+    $ say --serve &
+    $ say "spoken by the daemon, queued behind other callers"
+    $ say "disk full on backup01" --priority urgent --ttl 60
+    $ say "$(cat status-report.txt)" --stream
+    $ tail -f app.log | say --follow --backpressure coalesce
+    $ say --render-to prompts/ prompts.jsonl --jobs 4
+    $ say --worker --listen 0.0.0.0:1315 &
+    $ SAY_WORKERS=server1:1315,server2:1315 say "rendered on one of the servers"
 """
+import fcntl
+import hashlib
+import json
 import logging
 import os
+import re
+import shutil
+import socket
 import sys
 import subprocess
 import tempfile
-from docopt import docopt
+import threading
+import time
+from contextlib import contextmanager
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -33,65 +76,191 @@ logger.addHandler(handler)
 
 __version__ = (0,1,25)
 _VERBOSITY  = 0
-_ENGINES    = ['festival', 'espeak', 'dummy']
-ENGINE_DEFAULT=_ENGINES[1]
+_ENGINE_BINARIES = ['festival', 'espeak'] # engines which need a binary in PATH
+_ENGINE_LIBRARIES = ['espeak-ng', 'espeak'] # libraries for the espeak-lib engine, preferred first
+ESPEAK_LIBRARY=os.environ.get('SAY_ESPEAK_LIB') # path of libespeak(-ng), default: looked up like the linker does
 ENABLE_TTS_ONLINE=True # because we can ;)
-if ENABLE_TTS_ONLINE:
-    try:
-        from gtts import gTTS
-        _gTTS = True
-    except ImportError:
-        _gTTS = False
-    if _gTTS:
-        _ENGINES.append('google')
-        ENGINE_DEFAULT='google'
-    os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1' # no "Hello from the pygame community..." on stdout.
-    try:
-        import pygame
-    except ImportError:
-        pygame=False
+ENABLE_TTS_DUMMY=os.environ.get('SAY_DUMMY_ENGINE') == '1' # silent engine for tests & benchmarks
+DUMMY_SECONDS_PER_CHAR=0.06 # length of the silence the dummy engine "speaks"
+GTTS_URL=os.environ.get('SAY_GTTS_URL') # send gTTS requests here instead of translate.google.*
+os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1' # no "Hello from the pygame community..." on stdout.
 AUDIO_PLAYER_BIN='ffplay -nodisp -autoexit'
 DELETE_AUDIO_FILES=True
+CACHE_ENABLED=True # keep rendered audio and replay it for repeated messages
+CACHE_DIR=os.environ.get('SAY_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'say'))
+CACHE_MAX_BYTES=int(os.environ.get('SAY_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+CAPABILITIES_FILE=os.path.join(CACHE_DIR, '.capabilities.json')
+LANG_DEFAULT='en'
+DAEMON_SOCKET=os.environ.get('SAY_SOCKET', os.path.join(os.environ.get('XDG_RUNTIME_DIR', tempfile.gettempdir()), 'say-{}.sock'.format(os.getuid())))
 
-def _check_engines(engines, ignore=['google']):
-    """
-    checks environment for available tts-binaries.
-    returns the available ones for being able to adjusts _ENGINES suiting
-    to that.
-    """
-    for e in engines:
-        if e in ignore:
+# --- engine registry
+# nothing is probed or imported at import time. the capabilities of the
+# environment (binaries in PATH, importable modules) are determined on first
+# use and kept in CAPABILITIES_FILE. the file is only trusted as long as PATH,
+# the interpreter and the mtimes of the directories in PATH and sys.path (and
+# of the linker cache) are unchanged - installing or removing a binary, a
+# module or a library touches one of them.
+
+_capabilities = None
+_capabilities_lock = threading.Lock()
+_gTTS = None
+_pygame = None
+
+def _fingerprint():
+    dirs = {}
+    for d in os.environ.get('PATH', '').split(os.pathsep) + sys.path + ['/etc/ld.so.cache']:
+        if not d or d in dirs:
             continue
-        rc = os.system('which {} 2>&1 > /dev/null'.format(e))
-        if rc != 0:
-            logger.debug("tts-engine '{}' not available. removing from candidates.".format(e))
-            engines.remove(e)
+        try:
+            dirs[d] = os.stat(d).st_mtime
+        except OSError:
+            dirs[d] = None
+    return {'path': os.environ.get('PATH', ''), 'python': sys.executable, 'dirs': dirs}
+
+
+def _probe():
+    """checks the environment for tts-binaries and -libraries, the audio player and optional modules."""
+    import ctypes.util
+    import importlib.util
+    binaries = {}
+    for b in _ENGINE_BINARIES + ['text2wave', 'ffmpeg', AUDIO_PLAYER_BIN.split()[0]]:
+        binaries[b] = shutil.which(b)
+        if not binaries[b]:
+            logger.debug("binary '{}' not available.".format(b))
+    modules = {}
+    for m in ['gtts', 'pygame']:
+        try:
+            modules[m] = importlib.util.find_spec(m) is not None
+        except (ImportError, ValueError):
+            modules[m] = False
+    libraries = {}
+    for l in _ENGINE_LIBRARIES:
+        libraries[l] = ctypes.util.find_library(l)
+    return {'binaries': binaries, 'modules': modules, 'libraries': libraries}
+
+
+def _get_capabilities():
+    """returns the (cached) result of _probe(). probes only once, also if called by many threads at once."""
+    global _capabilities
+    if _capabilities is not None:
+        return _capabilities
+    with _capabilities_lock:
+        if _capabilities is not None: # probed while we waited for the lock
+            return _capabilities
+        fingerprint = _fingerprint()
+        try:
+            with open(CAPABILITIES_FILE) as fh:
+                cached = json.load(fh)
+            if cached.get('fingerprint') == fingerprint:
+                _capabilities = cached['capabilities']
+                return _capabilities
+        except (OSError, ValueError, KeyError):
+            pass
+        capabilities = _probe()
+        try:
+            os.makedirs(os.path.dirname(CAPABILITIES_FILE), exist_ok=True)
+            fn_tmp = CAPABILITIES_FILE + '.' + str(os.getpid())
+            with open(fn_tmp, 'w') as fh:
+                json.dump({'fingerprint': fingerprint, 'capabilities': capabilities}, fh)
+            os.replace(fn_tmp, CAPABILITIES_FILE)
+        except OSError as e:
+            logger.debug("could not write '{}': {}".format(CAPABILITIES_FILE, e))
+        _capabilities = capabilities
+        return _capabilities
+
+
+def _has_binary(name):
+    return bool(_get_capabilities()['binaries'].get(name))
+
+
+def _espeak_library():
+    """returns the path (or soname) of libespeak(-ng) or None."""
+    if ESPEAK_LIBRARY:
+        return ESPEAK_LIBRARY
+    libraries = _get_capabilities().get('libraries', {})
+    for l in _ENGINE_LIBRARIES:
+        if libraries.get(l):
+            return libraries[l]
+    return None
+
+
+def _get_gtts():
+    """imports gTTS on first use. returns the gTTS class or False."""
+    global _gTTS
+    if _gTTS is None:
+        try:
+            from gtts import gTTS
+            _gTTS = gTTS
+        except ImportError:
+            _gTTS = False
+    return _gTTS
+
+
+def _get_pygame():
+    """imports pygame on first use. returns the module or False."""
+    global _pygame
+    if _pygame is None:
+        try:
+            import pygame
+            _pygame = pygame
+        except ImportError:
+            _pygame = False
+    return _pygame
+
+
+def available_engines():
+    engines = [e for e in _ENGINE_BINARIES if _has_binary(e)]
+    if _espeak_library():
+        engines.append('espeak-lib')
+    if ENABLE_TTS_ONLINE and _get_capabilities()['modules'].get('gtts'):
+        engines.append('google')
+    if ENABLE_TTS_DUMMY:
+        engines.append('dummy')
     return engines
-_ENGINES = _check_engines(_ENGINES)
+
+
+def default_engine():
+    """
+    returns the engine used if none was asked for: espeak-lib, espeak or
+    else the first available one. google (online) only if it's the only one.
+    """
+    engines = available_engines()
+    for engine in ('espeak-lib', 'espeak'):
+        if engine in engines:
+            return engine
+    if not engines:
+        raise Exception("sorry, no tts-engine available. install espeak, festival or gtts.")
+    return sorted(engines, key=lambda e: e == 'google')[0]
+
+
+def __getattr__(name):
+    # ENGINE_DEFAULT & _ENGINES used to be computed at import time.
+    if name == 'ENGINE_DEFAULT':
+        return default_engine()
+    if name == '_ENGINES':
+        return available_engines()
+    raise AttributeError("module '{}' has no attribute '{}'".format(__name__, name))
+
 
 def _check_requirements():
     crit = 0
     warn = 0
     info = 0
-    if not len(_ENGINES) > 0:
+    engines = available_engines()
+    if not len(engines) > 0:
         logger.critical('no tts-engines available. please install at leat one. (under debian you can use `sudo apt-get install espeak` for example')
         crit += 1
-    logger.debug('available engines: {}'.format(_ENGINES))
-    rc = os.system('which {} 2>&1 > /dev/null'.format(AUDIO_PLAYER_BIN.split()[0]))
-    if rc != 0:
+    logger.debug('available engines: {}'.format(engines))
+    has_pygame = _get_capabilities()['modules'].get('pygame')
+    if not _has_binary(AUDIO_PLAYER_BIN.split()[0]) and not has_pygame:
         logger.warning("AUDIO_PLAYER_BIN='{}' not available. it may be not possible to use TTS-APIs!".format(AUDIO_PLAYER_BIN))
         warn += 1
-    if not pygame:
+    if not has_pygame:
         logger.info('pygame not available. it may be not possible to use TTS-APIs!')
         info += 1
     if crit > 0:
         return False
     return True
-_check_requirements()
-
-
-def available_engines():
-    return _ENGINES
 
 
 def version():
@@ -100,73 +269,2579 @@ def version():
     return __version__
 
 
-def _play_audio(file, audio_player=AUDIO_PLAYER_BIN):
-    assert(isinstance(file,str))
-    assert(isinstance(audio_player,str) and len(audio_player.strip()) > 0)
-    if audio_player:
-        logger.debug("_play_audio '{}' with {}".format(file, audio_player))
-        cmd = '{} {}'.format(audio_player,file)
-        #subprocess.call(['{}'.format(cmd)], shell=True)
-        proc = subprocess.Popen([cmd], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        output, errors = proc.communicate()
-        rc = proc.wait()
-        if rc == 0:
-            return True
+# --- metrics
+# the stages of an utterance (text handling, cache lookup, synthesis, network,
+# cache store, player start, playback) are wrapped in _stage(). with metrics
+# disabled (no hook, no export configured) that is a shared no-op context
+# manager. otherwise every stage is timed and
+#
+#   - passed to the hooks registered with add_stage_hook(),
+#   - aggregated into per stage/engine histograms and error counters,
+#   - appended to METRICS_LOG as json-line,
+#   - written to METRICS_PROM (prometheus textfile-collector format) by
+#     metrics_flush(), together with cache and queue stats.
+#
+# the prometheus file reflects one process - it's meant for the daemon.
+
+METRICS_LOG=os.environ.get('SAY_METRICS_LOG')
+METRICS_PROM=os.environ.get('SAY_METRICS_PROM')
+METRICS_BUCKETS=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class _NoStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+_NO_STAGE = _NoStage()
+
+
+class _Stage:
+    def __init__(self, metrics, stage, engine):
+        self.metrics = metrics
+        self.stage = stage
+        self.engine = engine
+
+    def __enter__(self):
+        self.t_start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.stage, self.engine, time.perf_counter() - self.t_start,
+                             None if exc_type is None else repr(exc))
+        return False
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hooks = []
+        self.histograms = {} # (stage, engine) -> [[count per bucket] + [+Inf], sum]
+        self.errors = {} # (stage, engine) -> count
+        self.gauges = {} # name -> value
+
+    def observe(self, stage, engine, seconds, error=None):
+        key = (stage, engine or '')
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = [[0] * (len(METRICS_BUCKETS) + 1), 0.0]
+            counts, _ = self.histograms[key]
+            for i, le in enumerate(METRICS_BUCKETS):
+                if seconds <= le:
+                    counts[i] += 1
+            counts[-1] += 1
+            self.histograms[key][1] += seconds
+            if error:
+                self.errors[key] = self.errors.get(key, 0) + 1
+        for hook in self.hooks:
+            hook(stage, engine, seconds, error)
+        if METRICS_LOG:
+            line = json.dumps({'ts': time.time(), 'pid': os.getpid(), 'stage': stage, 'engine': engine,
+                               'seconds': round(seconds, 6), 'error': error})
+            with open(METRICS_LOG, 'a') as fh:
+                fh.write(line + '\n')
+
+    def gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def prometheus(self):
+        """returns the metrics in prometheus text exposition format."""
+        lines = ['# HELP say_stage_seconds duration of the stages of an utterance',
+                 '# TYPE say_stage_seconds histogram']
+        with self.lock:
+            for (stage, engine), (counts, total) in sorted(self.histograms.items()):
+                labels = 'stage="{}",engine="{}"'.format(stage, engine)
+                for le, n in zip([str(b) for b in METRICS_BUCKETS] + ['+Inf'], counts):
+                    lines.append('say_stage_seconds_bucket{{{},le="{}"}} {}'.format(labels, le, n))
+                lines.append('say_stage_seconds_sum{{{}}} {}'.format(labels, total))
+                lines.append('say_stage_seconds_count{{{}}} {}'.format(labels, counts[-1]))
+            lines += ['# HELP say_errors_total failed stages', '# TYPE say_errors_total counter']
+            for (stage, engine), n in sorted(self.errors.items()):
+                lines.append('say_errors_total{{stage="{}",engine="{}"}} {}'.format(stage, engine, n))
+            gauges = dict(self.gauges)
+        cache = get_cache()
+        if cache:
+            for k, v in cache.stats().items():
+                gauges['say_cache_' + k] = v
+        for name, value in sorted(gauges.items()):
+            lines += ['# TYPE {} gauge'.format(name), '{} {}'.format(name, value)]
+        return '\n'.join(lines) + '\n'
+
+
+_metrics = Metrics()
+
+def metrics_enabled():
+    return bool(_metrics.hooks or METRICS_LOG or METRICS_PROM)
+
+
+def _stage(stage, engine=None):
+    """context manager timing one stage of an utterance (no-op while metrics are disabled)."""
+    if not metrics_enabled():
+        return _NO_STAGE
+    return _Stage(_metrics, stage, engine)
+
+
+def add_stage_hook(func):
+    """registers func(stage, engine, seconds, error) to be called after every stage."""
+    _metrics.hooks.append(func)
+
+
+def remove_stage_hook(func):
+    _metrics.hooks.remove(func)
+
+
+def metrics_gauge(name, value):
+    if metrics_enabled():
+        _metrics.gauge(name, value)
+
+
+def get_metrics():
+    return _metrics
+
+
+def metrics_flush():
+    """writes METRICS_PROM (atomically, as the textfile collector wants it)."""
+    if not METRICS_PROM:
+        return
+    fn_tmp = METRICS_PROM + '.' + str(os.getpid())
+    with open(fn_tmp, 'w') as fh:
+        fh.write(_metrics.prometheus())
+    os.replace(fn_tmp, METRICS_PROM)
+
+
+class CachedAudio(bytes):
+    """encoded audio which came from the AudioCache."""
+
+
+class AudioCache:
+    """
+    persistent, content-addressed store for rendered audio.
+
+    every entry is a file named after the sha256 of (engine, lang, voice params,
+    normalized text). the mtime of an entry is its last use, so evicting the
+    oldest files until the byte budget fits gives LRU. all mutations happen
+    under an flock() on `<path>/.lock` which makes it safe to share one cache
+    between many `say` processes. new entries are written to a dot-file first
+    and moved into place atomically.
+
+    a lookup only touches the mtime of the entry, the hit/miss counters are
+    kept in memory and added to `<path>/.stats.json` by the next put(), by
+    flush() or at exit (see get_cache()).
+    """
+    _STATS_FILE = '.stats.json'
+    _LOCK_FILE = '.lock'
+
+    def __init__(self, path=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        assert(isinstance(max_bytes,int) and max_bytes >= 0)
+        self.path = path
+        self.max_bytes = max_bytes
+        self._counts = {} # counter -> increment not yet written to .stats.json
+        self._counts_lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+
+    @staticmethod
+    def key(engine, msg, lang=LANG_DEFAULT, params=None):
+        """
+        returns the cache key for msg rendered by engine.
+        whitespace is normalized so trivially different messages share an entry.
+        """
+        normalized = ' '.join(msg.split())
+        blob = json.dumps([engine, lang, params or {}, normalized], sort_keys=True)
+        return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+    @contextmanager
+    def _lock(self):
+        with open(os.path.join(self.path, self._LOCK_FILE), 'a') as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _read_stats(self):
+        try:
+            with open(os.path.join(self.path, self._STATS_FILE)) as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def _write_stats(self, stats):
+        fn = os.path.join(self.path, self._STATS_FILE)
+        with open(fn + '.tmp', 'w') as fh:
+            json.dump(stats, fh)
+        os.replace(fn + '.tmp', fn)
+
+    def _count(self, counter, n=1):
+        """increments a counter in memory, see _flush()."""
+        with self._counts_lock:
+            self._counts[counter] = self._counts.get(counter, 0) + n
+
+    def _flush(self):
+        """adds the counters kept in memory to .stats.json. caller must hold the lock."""
+        with self._counts_lock:
+            counts, self._counts = self._counts, {}
+        if not counts:
+            return
+        stats = self._read_stats()
+        for counter, n in counts.items():
+            stats[counter] = stats.get(counter, 0) + n
+        self._write_stats(stats)
+
+    def flush(self):
+        """writes the hit/miss/eviction counters of this process to the cache."""
+        with self._lock():
+            self._flush()
+
+    def _entries(self):
+        """returns [(mtime, size, path), ...] of all entries, oldest first."""
+        entries = []
+        for fn in os.listdir(self.path):
+            if fn.startswith('.'):
+                continue
+            p = os.path.join(self.path, fn)
+            try:
+                st = os.stat(p)
+            except FileNotFoundError: # removed by a concurrent eviction
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+        entries.sort()
+        return entries
+
+    def get(self, key, suffix):
+        """
+        returns the cached audio (CachedAudio, i.e. bytes) for key or None.
+        a hit refreshes the entry's position in the LRU order. the audio is
+        read right away - a path could be evicted by another process before
+        the caller gets to open it.
+        """
+        fn = os.path.join(self.path, key + suffix)
+        try:
+            with open(fn, 'rb') as fh: # no lock needed, an evicted entry is a miss
+                audio = CachedAudio(fh.read())
+            os.utime(fn)
+        except FileNotFoundError:
+            self._count('misses')
+            return None
+        self._count('hits')
+        logger.debug("cache hit '{}'".format(fn))
+        return audio
+
+    def put(self, key, suffix, data):
+        """
+        stores the rendered audio (bytes) and evicts least recently used
+        entries if the byte budget is exceeded. returns the entry's path.
+        """
+        fn = os.path.join(self.path, key + suffix)
+        fn_tmp = os.path.join(self.path, '.tmp-' + next(tempfile._get_candidate_names()) + suffix)
+        try:
+            with open(fn_tmp, 'wb') as fh:
+                fh.write(data)
+            with self._lock():
+                os.replace(fn_tmp, fn)
+                self._evict(keep=fn)
+                self._flush()
+        finally:
+            if os.path.exists(fn_tmp): os.remove(fn_tmp)
+        return fn
+
+    def _evict(self, keep=None):
+        """removes the oldest entries until max_bytes fits. caller must hold the lock."""
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, p in entries:
+            if total <= self.max_bytes:
+                break
+            if p == keep:
+                continue
+            try:
+                os.remove(p)
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+        if evicted:
+            logger.debug("cache evicted {} entries".format(evicted))
+            self._count('evictions', evicted)
+
+    def stats(self):
+        """returns hit/miss/eviction counters and the current size of the cache."""
+        with self._lock():
+            stats = self._read_stats()
+            entries = self._entries()
+        with self._counts_lock:
+            for counter, n in self._counts.items():
+                stats[counter] = stats.get(counter, 0) + n
+        stats['entries'] = len(entries)
+        stats['bytes'] = sum(size for _, size, _ in entries)
+        stats['max_bytes'] = self.max_bytes
+        return stats
+
+    def clear(self):
+        with self._lock():
+            for _, _, p in self._entries():
+                os.remove(p)
+            with self._counts_lock:
+                self._counts = {}
+            self._write_stats({'hits': 0, 'misses': 0, 'evictions': 0})
+
+
+_cache = None
+def _flush_cache():
+    try:
+        _cache.flush()
+    except OSError as e: # e.g. the cache directory was removed meanwhile
+        logger.debug("could not write the cache counters: {}".format(e))
+
+
+def get_cache():
+    """returns the process-wide AudioCache (or None if caching is disabled)."""
+    global _cache
+    if not CACHE_ENABLED:
+        return None
+    if _cache is None:
+        try:
+            _cache = AudioCache(CACHE_DIR, CACHE_MAX_BYTES)
+            import atexit
+            atexit.register(_flush_cache)
+        except OSError as e:
+            logger.warning("audio cache '{}' not usable ({}). continuing without cache.".format(CACHE_DIR, e))
+            return None
+    return _cache
+
+
+def cache_stats():
+    cache = get_cache()
+    if not cache:
+        return {}
+    return cache.stats()
+
+
+# --- audio output
+# a sink plays audio given as file path, as encoded buffer (mp3/wav bytes) or
+# as raw pcm (signed 16 bit little endian) and returns a Playback handle which
+# tells when playback has finished. the process-wide sink (get_sink()) is
+# opened once and kept open, so an utterance doesn't pay for spawning a player
+# or opening the audio device. AUDIO_SINK selects it:
+#
+#   auto        pygame if the mixer can be opened, ffplay otherwise
+#   pygame      pygame.mixer, the device stays open for the life of the process
+#   ffplay      one AUDIO_PLAYER_BIN process per clip (the classic behaviour)
+#   null        discards everything (headless tests & benchmarks)
+#   null:realtime  like null but takes as long as the clip would play
+#   file:<dir>  writes every clip into dir
+
+AUDIO_SINK=os.environ.get('SAY_AUDIO_SINK', 'auto')
+MIXER_FREQUENCY=24000 # gTTS delivers 24kHz, espeak 22.05kHz - SDL converts
+MIXER_BUFFER=1024
+
+def _tmpfs_dir():
+    """
+    returns a directory for the rare case that a backend insists on a path.
+    prefers tmpfs (no wear on SD-cards) over the regular temp dir.
+    """
+    for d in ('/dev/shm', os.environ.get('XDG_RUNTIME_DIR')):
+        if d and os.path.isdir(d) and os.access(d, os.W_OK):
+            return d
+    return tempfile.gettempdir()
+
+
+def _pcm_to_wav(pcm, rate, channels=1):
+    """wraps raw s16le pcm into a wav container."""
+    import io
+    import wave
+    buf = io.BytesIO()
+    with wave.open(buf, 'wb') as w:
+        w.setnchannels(channels)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(pcm)
+    return buf.getvalue()
+
+
+def _concat_wavs(wavs):
+    """joins wav buffers of the same format into one."""
+    import io
+    import wave
+    if len(wavs) == 1:
+        return wavs[0]
+    frames, params = [], None
+    for data in wavs:
+        with wave.open(io.BytesIO(data)) as w:
+            params = params or w.getparams()
+            frames.append(w.readframes(w.getnframes()))
+    if params is None:
+        return _pcm_to_wav(b'', 16000)
+    buf = io.BytesIO()
+    with wave.open(buf, 'wb') as w:
+        w.setparams(params)
+        w.writeframes(b''.join(frames))
+    return buf.getvalue()
+
+
+def _sniff_format(data):
+    if data[:4] == b'RIFF':
+        return 'wav'
+    return 'mp3'
+
+
+GTTS_MP3_BITRATE=32000 # bit/s of the mp3s gTTS delivers
+
+def _audio_duration(data, fmt=None, rate=None, channels=1):
+    """returns the playing time (seconds) of a path, encoded buffer or raw pcm."""
+    import io
+    import wave
+    if isinstance(data, str):
+        with open(data, 'rb') as fh:
+            data = fh.read()
+    if fmt == 'pcm':
+        return len(data) / (2.0 * channels * rate)
+    if (fmt or _sniff_format(data)) == 'wav':
+        with wave.open(io.BytesIO(data)) as w:
+            return w.getnframes() / float(w.getframerate())
+    return len(data) * 8.0 / GTTS_MP3_BITRATE # estimate, good enough for cbr
+
+
+class Playback:
+    """handle of a clip handed to a sink."""
+    def __init__(self, is_busy=None, stop=None, result=None):
+        self._is_busy = is_busy
+        self._stop = stop
+        self._result = result
+        self.ok = True
+
+    def done(self):
+        return self._is_busy is None or not self._is_busy()
+
+    def wait(self, timeout=None):
+        """blocks until playback has finished (or timeout). returns True if it succeeded."""
+        t_end = None if timeout is None else time.monotonic() + timeout
+        while not self.done():
+            if t_end is not None and time.monotonic() > t_end:
+                return False
+            time.sleep(0.01)
+        if self._result:
+            self.ok = self._result()
+        return self.ok
+
+    def stop(self):
+        if self._stop and not self.done():
+            self._stop()
+
+
+class AudioSink:
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def play(self, data, fmt=None, rate=None, channels=1):
+        """
+        starts playing data, which is a path, encoded bytes (fmt 'mp3'/'wav',
+        sniffed if None) or raw pcm (fmt 'pcm', rate & channels required).
+        returns a Playback.
+        """
+        raise NotImplementedError
+
+
+class NullSink(AudioSink):
+    """
+    discards all audio. counts clips and bytes for tests and benchmarks.
+    with realtime=True a clip is "playing" for as long as it lasts.
+    """
+    def __init__(self, realtime=False):
+        self.realtime = realtime
+        self.clips = 0
+        self.bytes = 0
+
+    def play(self, data, fmt=None, rate=None, channels=1):
+        self.clips += 1
+        self.bytes += os.path.getsize(data) if isinstance(data, str) else len(data)
+        if not self.realtime:
+            return Playback()
+        state = {'t_end': time.monotonic() + _audio_duration(data, fmt, rate, channels)}
+        return Playback(lambda: time.monotonic() < state['t_end'], lambda: state.update(t_end=0))
+
+
+class FileSink(AudioSink):
+    """writes every clip as numbered file into a directory."""
+    def __init__(self, path):
+        self.path = path
+        self.clips = 0
+
+    def open(self):
+        os.makedirs(self.path, exist_ok=True)
+
+    def play(self, data, fmt=None, rate=None, channels=1):
+        self.open()
+        if isinstance(data, str):
+            fmt = fmt or os.path.splitext(data)[1].lstrip('.')
+            with open(data, 'rb') as fh:
+                data = fh.read()
+        if fmt == 'pcm':
+            data, fmt = _pcm_to_wav(data, rate, channels), 'wav'
+        self.clips += 1
+        fn = os.path.join(self.path, '{:05d}.{}'.format(self.clips, fmt or _sniff_format(data)))
+        with open(fn, 'wb') as fh:
+            fh.write(data)
+        logger.debug("FileSink wrote '{}'".format(fn))
+        return Playback()
+
+
+class ProcessSink(AudioSink):
+    """spawns AUDIO_PLAYER_BIN per clip. buffers are piped into its stdin."""
+    def __init__(self, player=AUDIO_PLAYER_BIN):
+        assert(isinstance(player,str) and len(player.strip()) > 0)
+        self.player = player.split()
+
+    def play(self, data, fmt=None, rate=None, channels=1):
+        logger.debug("play with {}".format(self.player))
+        if isinstance(data, str):
+            proc = subprocess.Popen(self.player + [data], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
         else:
-            logger.critical("playing audio file '{}' failed.".format(file))
-            return False
-    elif pygame:
-        logger.debug("_play_audio '{}' with pygame".format(file))
-        pygame.mixer.init()
-        pygame.mixer.music.load(file)
-        pygame.mixer.music.play()
-        return True
-    else:
-        logger.critical("no audio player available.")
+            args = ['-f', 's16le', '-ar', str(rate), '-ac', str(channels)] if fmt == 'pcm' else []
+            proc = subprocess.Popen(self.player + args + ['-i', '-'], stdin=subprocess.PIPE,
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            def feed():
+                try:
+                    proc.stdin.write(data)
+                    proc.stdin.close()
+                except OSError: # player died or was stopped
+                    pass
+            threading.Thread(target=feed, daemon=True).start()
+        return Playback(lambda: proc.poll() is None, proc.terminate, lambda: proc.wait() == 0)
+
+
+class PygameSink(AudioSink):
+    """plays through pygame.mixer which is initialized once and kept open."""
+    def __init__(self, frequency=MIXER_FREQUENCY, buffer=MIXER_BUFFER):
+        self.frequency = frequency
+        self.buffer = buffer
+        self._lock = threading.Lock()
+        self.pygame = None
+
+    def open(self):
+        with self._lock:
+            if self.pygame:
+                return
+            pygame = _get_pygame()
+            if not pygame:
+                raise Exception("pygame not available")
+            pygame.mixer.init(frequency=self.frequency, size=-16, channels=1, buffer=self.buffer)
+            self.pygame = pygame
+            logger.debug("pygame.mixer opened: {}".format(pygame.mixer.get_init()))
+
+    def close(self):
+        with self._lock:
+            if self.pygame:
+                self.pygame.mixer.quit()
+                self.pygame = None
+
+    def play(self, data, fmt=None, rate=None, channels=1):
+        import io
+        self.open()
+        mixer = self.pygame.mixer
+        if isinstance(data, str):
+            fmt = fmt or os.path.splitext(data)[1].lstrip('.')
+            src = data
+        else:
+            if fmt == 'pcm':
+                data, fmt = _pcm_to_wav(data, rate, channels), 'wav'
+            fmt = fmt or _sniff_format(data)
+            src = io.BytesIO(data)
+        if fmt == 'wav':
+            sound = mixer.Sound(src)
+            with self._lock: # two threads must not pick the same free channel
+                channel = mixer.find_channel()
+                if channel is None: # all channels busy (Sound.play() would return None): add some
+                    mixer.set_num_channels(mixer.get_num_channels() + 8)
+                    channel = mixer.find_channel(True)
+                channel.play(sound)
+            return Playback(channel.get_busy, channel.stop)
+        if isinstance(src, str):
+            mixer.music.load(src)
+        else:
+            try:
+                mixer.music.load(src, fmt)
+            except TypeError: # pygame < 2.0 wants a path
+                fn = os.path.join(_tmpfs_dir(), next(tempfile._get_candidate_names()) + '.' + fmt)
+                with open(fn, 'wb') as fh:
+                    fh.write(data)
+                try:
+                    mixer.music.load(fn)
+                finally:
+                    if DELETE_AUDIO_FILES: os.remove(fn) # the mixer keeps it open
+        mixer.music.play()
+        return Playback(mixer.music.get_busy, mixer.music.stop)
+
+
+_sink = None
+_sink_lock = threading.Lock()
+def get_sink():
+    """returns the process-wide AudioSink selected by AUDIO_SINK, opened on first use."""
+    global _sink
+    with _sink_lock:
+        if _sink is not None:
+            return _sink
+        name = AUDIO_SINK
+        if name.startswith('file:'):
+            _sink = FileSink(name[len('file:'):])
+        elif name == 'null':
+            _sink = NullSink()
+        elif name == 'null:realtime':
+            _sink = NullSink(realtime=True)
+        elif name == 'ffplay':
+            _sink = ProcessSink()
+        elif name in ('auto', 'pygame'):
+            try:
+                _sink = PygameSink()
+                _sink.open()
+            except Exception as e:
+                if name == 'pygame':
+                    raise
+                logger.debug("pygame sink not usable ({}). using '{}'.".format(e, AUDIO_PLAYER_BIN))
+                _sink = ProcessSink()
+        else:
+            raise Exception("unknown AUDIO_SINK '{}'".format(name))
+        _sink.open()
+        return _sink
+
+
+def set_sink(sink):
+    """replaces the process-wide sink, e.g. by a NullSink in tests."""
+    global _sink
+    with _sink_lock:
+        if _sink is not None and _sink is not sink:
+            _sink.close()
+        _sink = sink
+
+
+class Interrupted(Exception):
+    """
+    the playback was stopped by stop_playback() (started=True) or, because
+    its cancel event was set in time, not even started (started=False).
+    """
+    def __init__(self, msg, started=True):
+        Exception.__init__(self, msg)
+        self.started = started
+
+
+_playing = {} # Playback -> True if stopped by stop_playback()
+_playing_lock = threading.Lock()
+
+
+def stop_playback():
+    """
+    stops all clips this process is playing right now. the say() calls
+    playing them raise Interrupted. returns the number of stopped clips.
+    """
+    with _playing_lock:
+        for playback in _playing:
+            _playing[playback] = True
+            playback.stop()
+        return len(_playing)
+
+
+def _play_audio(file, sink=None, engine=None, cancel=None):
+    """
+    plays the audio file (or buffer) and blocks until it has finished.
+    raises Interrupted if stopped by stop_playback() or if the threading.Event
+    cancel is set (before or while playing).
+    """
+    if cancel is not None and cancel.is_set():
+        raise Interrupted("cancelled before playback", started=False)
+    with _stage('player_start', engine):
+        sink = sink or get_sink()
+        logger.debug("_play_audio '{}' with {}".format(file if isinstance(file, str) else '<buffer>', sink.__class__.__name__))
+        playback = sink.play(file)
+    with _playing_lock:
+        _playing[playback] = False
+        if cancel is not None and cancel.is_set(): # set between the check above and now
+            _playing[playback] = True
+            playback.stop()
+    try:
+        with _stage('playback', engine):
+            ok = playback.wait()
+    finally:
+        with _playing_lock:
+            stopped = _playing.pop(playback)
+    if stopped:
+        raise Interrupted("playback stopped")
+    if not ok:
+        logger.critical("playing audio file '{}' failed.".format(file))
         return False
+    return True
+
 
+_AUDIO_SUFFIX = {'google': '.mp3', 'google_online': '.mp3', 'espeak': '.wav', 'espeak-lib': '.wav', 'festival': '.wav', 'dummy': '.wav'}
 
-def say(msg, engine=ENGINE_DEFAULT):
+def _can_render(engine):
     """
+    True if engine's output can be captured into a file or buffer (and hence
+    be cached). festival needs its `text2wave` helper or a festival server
+    (see FestivalWorker) for that.
     """
-    assert(isinstance(msg,str))
-    fn_audio, tts_cmd = None, None
-    if engine not in _ENGINES:
-        raise Exception("sorry, engine '{}' not available.".format(engine))
     if engine == 'festival':
-        tts_cmd = 'echo "{}" | festival --tts'.format(msg)
-    elif engine == 'espeak':
-        tts_cmd = 'espeak "{}"'.format(msg)
+        return _has_binary('text2wave') or (ENGINE_WORKERS and _has_binary('festival'))
+    return engine in _AUDIO_SUFFIX
+
+
+def _render(msg, engine, fn_audio, lang=LANG_DEFAULT):
+    """
+    renders msg with engine into the audio file fn_audio instead of the speaker
+    (via _render_bytes(), so remote workers are asked once).
+    """
+    audio = _render_bytes(msg, engine, lang)
+    with open(fn_audio, 'wb') as fh:
+        fh.write(audio)
+
+
+def _dummy_wav(msg, rate=22050):
+    """the dummy engine: silence, DUMMY_SECONDS_PER_CHAR per character."""
+    return _pcm_to_wav(b'\0\0' * int(rate * DUMMY_SECONDS_PER_CHAR * len(msg)), rate)
+
+
+def _gtts_decode(text):
+    """extracts the audio from a (batchexecute) response of the gTTS endpoint."""
+    import base64
+    audio = []
+    for line in text.splitlines():
+        if 'jQ1olc' in line:
+            m = re.search(r'jQ1olc","\[\\"(.*)\\"]', line)
+            if not m:
+                raise Exception("gTTS: no audio in response")
+            audio.append(base64.b64decode(m.group(1)))
+    return b''.join(audio)
+
+
+GTTS_FETCH_WORKERS = 4 # chunks of one utterance fetched at the same time
+GTTS_RETRIES = 2 # per chunk, on connection errors, timeouts, 429 and 5xx
+GTTS_BACKOFF = 0.25 # seconds before the first retry, doubled for each further one
+GTTS_DEADLINE = float(os.environ.get('SAY_GTTS_DEADLINE', 20)) # seconds for all chunks of an utterance
+_gtts_session = None
+_gtts_pool = None
+_gtts_pid = None
+_gtts_lock = threading.Lock()
+
+
+def _get_gtts_session():
+    """
+    returns the keep-alive session (and the thread pool) for talking to the
+    gTTS endpoint, shared by all utterances of this process.
+    """
+    global _gtts_session, _gtts_pool, _gtts_pid
+    with _gtts_lock:
+        if _gtts_pid != os.getpid(): # (re)create after a fork, connections & threads don't survive it
+            import requests
+            from concurrent.futures import ThreadPoolExecutor
+            _gtts_session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=GTTS_FETCH_WORKERS)
+            _gtts_session.mount('https://', adapter)
+            _gtts_session.mount('http://', adapter)
+            _gtts_pool = ThreadPoolExecutor(GTTS_FETCH_WORKERS, thread_name_prefix='say-gtts')
+            _gtts_pid = os.getpid()
+        return _gtts_session, _gtts_pool
+
+
+def _gtts_fetch_one(pr, deadline, timeout=None):
+    """sends one prepared request, retrying with backoff until deadline. returns the audio."""
+    import requests
+    session, _ = _get_gtts_session()
+    for attempt in range(GTTS_RETRIES + 1):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise Exception("gTTS: deadline of {}s exceeded".format(GTTS_DEADLINE))
+        try:
+            with _stage('network', 'google'):
+                r = session.send(pr, timeout=min(timeout or remaining, remaining))
+                if r.status_code == 429 or r.status_code >= 500:
+                    raise requests.ConnectionError("http status {}".format(r.status_code))
+                r.raise_for_status()
+            return _gtts_decode(r.text)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == GTTS_RETRIES:
+                raise
+            backoff = GTTS_BACKOFF * 2 ** attempt
+            logger.info("gTTS: {}. retrying in {:.2f}s".format(e, backoff))
+            time.sleep(min(backoff, max(0.0, deadline - time.monotonic())))
+
+
+def _gtts_fetch(tts, url=None):
+    """
+    sends the requests gTTS prepared for tts (one per chunk of ~100 chars)
+    over the shared keep-alive session - concurrently, reassembled in order.
+    url (default GTTS_URL) replaces google's, e.g. by a local stand-in.
+    returns the audio.
+    """
+    deadline = time.monotonic() + GTTS_DEADLINE
+    try: # private api of gTTS, see requirements.txt for the versions known to have it
+        prs = tts._prepare_requests()
+        timeout = tts.timeout
+        for pr in prs:
+            if url or GTTS_URL:
+                pr.url = url or GTTS_URL
+    except (AttributeError, TypeError) as e:
+        logger.warning("gTTS internals changed ({}). fetching the chunks one by one via gTTS.".format(e))
+        import io
+        buf = io.BytesIO()
+        with _stage('network', 'google'):
+            tts.write_to_fp(buf)
+        return buf.getvalue()
+    if len(prs) == 1:
+        return _gtts_fetch_one(prs[0], deadline, timeout)
+    _, pool = _get_gtts_session()
+    futures = [pool.submit(_gtts_fetch_one, pr, deadline, timeout) for pr in prs]
+    try:
+        return b''.join(f.result() for f in futures)
+    finally:
+        for f in futures:
+            f.cancel()
+
+
+# --- engine workers
+# festival needs seconds to start and load its voice. instead of paying that
+# per utterance a `festival --server` is kept running and asked for the
+# waveforms over its socket protocol (the one of festival_client). a server
+# already listening on FESTIVAL_PORT is used as it is, otherwise long-running
+# processes (daemon, follow) start one, see start_workers(). espeak starts
+# fast and can't hand out one wav per utterance when running on, so it is
+# still exec'd per utterance (without a shell).
+
+ENGINE_WORKERS = os.environ.get('SAY_ENGINE_WORKERS', '1') != '0'
+FESTIVAL_HOST = '127.0.0.1'
+FESTIVAL_PORT = int(os.environ.get('SAY_FESTIVAL_PORT', 1314))
+FESTIVAL_START_TIMEOUT = 30 # seconds a new server may need to accept connections
+FESTIVAL_TIMEOUT = 120 # seconds to wait for the waveforms of one utterance
+_FESTIVAL_KEY = b'ft_StUfF_key' # terminates (stuffed) data in festival's protocol
+
+
+def _scheme_str(text):
+    return '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+class FestivalWorker:
+    """
+    client of a festival server. reconnects (and restarts the server if it
+    was started here) once when a request fails. a worker which still fails
+    is dropped, see _drop_festival().
+    """
+    def __init__(self, host=FESTIVAL_HOST, port=FESTIVAL_PORT):
+        self.host = host
+        self.port = port
+        self.proc = None # the server, if started by us
+        self.sock = None
+        self.buf = b''
+        self.lock = threading.Lock()
+        self.restarts = 0
+        self.pid = os.getpid() # a forked child must not share the connection
+
+    def connect(self, timeout=0):
+        deadline = time.time() + timeout
+        while True:
+            try:
+                self.sock = socket.create_connection((self.host, self.port), timeout=FESTIVAL_TIMEOUT)
+                self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                break
+            except OSError:
+                if time.time() >= deadline or (self.proc and self.proc.poll() is not None):
+                    raise
+                time.sleep(0.1)
+        self.buf = b''
+        self._command("(Parameter.set 'Wavefiletype 'riff)")
+        self._command("(tts_return_to_client)")
+        return self
+
+    def spawn(self):
+        self.close()
+        if self.proc and self.proc.poll() is None:
+            self.proc.kill()
+            self.proc.wait()
+        logger.info("starting festival server on port {}".format(self.port))
+        self.proc = subprocess.Popen(['festival', '--server', '(set! server_port {})'.format(self.port)],
+                                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return self.connect(FESTIVAL_START_TIMEOUT)
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+    def stop(self):
+        self.close()
+        if self.proc and self.proc.poll() is None:
+            self.proc.terminate()
+            self.proc.wait()
+
+    def _read(self, n):
+        while len(self.buf) < n:
+            self._recv()
+        data, self.buf = self.buf[:n], self.buf[n:]
+        return data
+
+    def _read_stuffed(self):
+        while _FESTIVAL_KEY not in self.buf:
+            self._recv()
+        data, self.buf = self.buf.split(_FESTIVAL_KEY, 1)
+        return data.replace(_FESTIVAL_KEY[:-1] + b'X', _FESTIVAL_KEY[:-1])
+
+    def _recv(self):
+        if hasattr(socket, 'TCP_QUICKACK'): # don't let the server's small final write wait for our delayed ack (linux)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+        chunk = self.sock.recv(65536)
+        if not chunk:
+            raise ConnectionError("festival server closed the connection")
+        self.buf += chunk
+
+    def _command(self, cmd):
+        """sends a scheme command. returns the waveforms of the reply."""
+        self.sock.sendall(cmd.encode('utf-8') + b'\n')
+        waves = []
+        while True:
+            code = self._read(3)
+            if code == b'WV\n':
+                waves.append(self._read_stuffed())
+            elif code == b'LP\n':
+                self._read_stuffed()
+            elif code == b'OK\n':
+                return waves
+            elif code == b'ER\n':
+                raise Exception("festival server: error on {}".format(cmd[:80]))
+            else:
+                raise ConnectionError("festival server: unexpected reply {!r}".format(code))
+
+    def synthesize(self, msg):
+        """returns msg rendered as wav (bytes)."""
+        with self.lock:
+            for attempt in (1, 2):
+                try:
+                    if self.sock is None:
+                        if self.proc and self.proc.poll() is not None:
+                            raise ConnectionError("festival server exited with {}".format(self.proc.returncode))
+                        self.connect()
+                    return _concat_wavs(self._command('(tts_textall {} "nil")'.format(_scheme_str(msg))))
+                except (OSError, ConnectionError) as e:
+                    self.close()
+                    if attempt == 2 or not self.proc:
+                        _drop_festival(self)
+                        raise
+                    logger.warning("festival server failed ({}). restarting it.".format(e))
+                    self.restarts += 1
+                    self.spawn()
+
+
+_festival = None
+_festival_lock = threading.Lock()
+
+
+def _get_festival(spawn=False):
+    """
+    returns the FestivalWorker if a festival server is reachable (or could be
+    started with spawn=True), None otherwise.
+    """
+    global _festival
+    if not ENGINE_WORKERS or not _has_binary('festival'):
+        return None
+    with _festival_lock:
+        if _festival is None or _festival.pid != os.getpid():
+            worker = FestivalWorker()
+            try:
+                worker.connect()
+            except OSError:
+                if not spawn:
+                    return None
+                try:
+                    worker.spawn()
+                except OSError as e:
+                    logger.warning("could not start a festival server: {}".format(e))
+                    worker.stop()
+                    return None
+                import atexit
+                atexit.register(worker.stop)
+            _festival = worker
+        return _festival
+
+
+def _drop_festival(worker):
+    """forgets the failed worker, so _get_festival() tries to connect (or spawn) again."""
+    global _festival
+    with _festival_lock:
+        if _festival is worker:
+            _festival = None
+    worker.stop()
+
+
+def start_workers(engines=None):
+    """
+    starts the persistent workers of engines (default: all available), e.g.
+    for processes which speak many utterances.
+    """
+    for engine in (engines or available_engines()):
+        if engine == 'festival':
+            _get_festival(spawn=True)
+
+
+def _worker(engine):
+    if engine == 'festival':
+        return _get_festival(spawn=not _has_binary('text2wave'))
+    return None
+
+
+def _worker_synthesize(engine, msg):
+    """
+    returns msg rendered by the persistent worker of engine or None if there
+    is none. a failed worker is dropped and looked up once more (which may
+    start a new server or give None, e.g. to use text2wave instead).
+    """
+    for attempt in (1, 2):
+        worker = _worker(engine)
+        if not worker:
+            return None
+        try:
+            return worker.synthesize(msg)
+        except (OSError, ConnectionError) as e:
+            if attempt == 2:
+                raise
+            logger.warning("{} worker failed ({}). trying without it.".format(engine, e))
+
+
+class EspeakLib:
+    """
+    libespeak(-ng) loaded via ctypes. synthesizes in-process (synchronous mode,
+    the pcm is handed over to a callback) - no fork/exec, no quoting. the
+    library isn't reentrant, so calls are serialized.
+    """
+    AUDIO_OUTPUT_SYNCHRONOUS = 2
+    INITIALIZE_DONT_EXIT = 0x8000
+    POS_CHARACTER = 1
+    CHARS_UTF8 = 1
+
+    def __init__(self, path, voice=LANG_DEFAULT):
+        import ctypes
+        self._string_at = ctypes.string_at
+        self.lib = lib = ctypes.CDLL(path)
+        lib.espeak_Initialize.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_char_p, ctypes.c_int]
+        lib.espeak_Initialize.restype = ctypes.c_int
+        self.rate = lib.espeak_Initialize(self.AUDIO_OUTPUT_SYNCHRONOUS, 0, None, self.INITIALIZE_DONT_EXIT)
+        if self.rate <= 0:
+            raise Exception("espeak_Initialize() of '{}' failed".format(path))
+        callback_type = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.POINTER(ctypes.c_short), ctypes.c_int, ctypes.c_void_p)
+        self._callback = callback_type(self._on_synth) # referenced as long as the library may call it
+        lib.espeak_SetSynthCallback.argtypes = [callback_type]
+        lib.espeak_SetSynthCallback.restype = None
+        lib.espeak_SetSynthCallback(self._callback)
+        lib.espeak_SetVoiceByName.argtypes = [ctypes.c_char_p]
+        lib.espeak_SetVoiceByName.restype = ctypes.c_int
+        if lib.espeak_SetVoiceByName(voice.encode('utf-8')) != 0:
+            logger.warning("espeak-lib: voice '{}' not found, using the default voice".format(voice))
+        lib.espeak_Synth.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_uint, ctypes.c_int, ctypes.c_uint,
+                                     ctypes.c_uint, ctypes.POINTER(ctypes.c_uint), ctypes.c_void_p]
+        lib.espeak_Synth.restype = ctypes.c_int
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self._chunks = []
+
+    def _on_synth(self, wav, numsamples, events):
+        if wav and numsamples > 0:
+            self._chunks.append(self._string_at(wav, numsamples * 2))
+        return 0 # continue
+
+    def synthesize(self, msg):
+        """returns msg rendered as wav (bytes)."""
+        text = msg.encode('utf-8') + b'\0'
+        with self.lock:
+            self._chunks = []
+            err = self.lib.espeak_Synth(text, len(text), 0, self.POS_CHARACTER, 0, self.CHARS_UTF8, None, None)
+            pcm, self._chunks = b''.join(self._chunks), []
+        if err != 0:
+            raise Exception("espeak_Synth() failed with error {}".format(err))
+        return _pcm_to_wav(pcm, self.rate)
+
+
+_espeak_lib = None
+_espeak_lib_lock = threading.Lock()
+
+
+def _get_espeak_lib():
+    global _espeak_lib
+    with _espeak_lib_lock:
+        if _espeak_lib is None or _espeak_lib.pid != os.getpid():
+            _espeak_lib = EspeakLib(_espeak_library())
+        return _espeak_lib
+
+
+_RENDER_CMDS = { # text on stdin, wav on stdout
+    'festival': ['text2wave'],
+    'espeak': ['espeak', '--stdout', '--stdin'],
+}
+
+def _render_bytes(msg, engine, lang=LANG_DEFAULT, use_cache=True):
+    """
+    renders msg with engine into memory and returns the encoded audio (bytes).
+    nothing touches the filesystem: gTTS writes into a BytesIO, espeak and
+    text2wave write their wav to stdout. remote workers (SAY_WORKERS) are
+    asked first, use_cache tells them whether to use their cache.
+    """
+    workers = get_remote_workers()
+    if workers:
+        audio = workers.render(msg, engine, lang, use_cache)
+        if audio is not None:
+            return audio
+    wav = _worker_synthesize(engine, msg)
+    if wav is not None:
+        return wav
+    if engine in _RENDER_CMDS:
+        return subprocess.run(_RENDER_CMDS[engine], input=msg.encode('utf-8'),
+                              stdout=subprocess.PIPE, check=True).stdout
     elif engine == 'google' or engine == 'google_online':
-        tts = gTTS(msg, lang='en')
-        suf = '.mp3'
-        fn_audio = os.path.join(tempfile.gettempdir(), next(tempfile._get_candidate_names()) + suf)
-        logger.debug("...saving tts-result into '{}'".format(fn_audio))
-        tts.save(fn_audio)
-    if not fn_audio:
-        if tts_cmd:
-            subprocess.call(['{}'.format(tts_cmd)], shell=True)
+        return _gtts_fetch(_get_gtts()(msg, lang=lang))
+    elif engine == 'espeak-lib':
+        return _get_espeak_lib().synthesize(msg)
+    elif engine == 'dummy':
+        return _dummy_wav(msg)
+    raise Exception("whooops. Sry, engine='{}' can not render into memory".format(engine))
+
+
+def _synthesize(msg, engine, use_cache=True):
+    """
+    renders msg with engine, using the audio cache if enabled. returns the
+    encoded audio (bytes, a CachedAudio on a cache hit), which can be handed
+    to a sink as it is.
+    """
+    suffix = _AUDIO_SUFFIX[engine]
+    cache = get_cache() if use_cache else None
+    if cache:
+        with _stage('cache_lookup', engine):
+            key = cache.key(engine, msg, LANG_DEFAULT)
+            audio = cache.get(key, suffix)
+        if audio is not None:
+            return audio
+    with _stage('synthesize', engine):
+        audio = _render_bytes(msg, engine, use_cache=use_cache)
+    if cache:
+        with _stage('cache_store', engine):
+            cache.put(key, suffix, audio)
+    return audio
+
+
+def _split_sentences(text, max_len=160):
+    """
+    splits text into sentences. sentences longer than max_len chars are split
+    further at clause boundaries (',', ';', ':') where possible.
+    """
+    segments = []
+    for sentence in re.split(r'(?<=[.!?])\s+', text.strip()):
+        while len(sentence) > max_len:
+            cut = max(sentence.rfind(sep, 0, max_len) for sep in (', ', '; ', ': '))
+            if cut <= 0:
+                cut = sentence.rfind(' ', 0, max_len)
+            if cut <= 0:
+                break
+            segments.append(sentence[:cut + 1].strip())
+            sentence = sentence[cut + 1:].strip()
+        if sentence:
+            segments.append(sentence)
+    return segments
+
+
+def say_stream(msg, engine=None, use_cache=True, lookahead=1, cancel=None):
+    """
+    speaks msg sentence by sentence. a worker thread synthesizes the next
+    `lookahead` segments while the current one is playing, so playback of a
+    long text starts after the first sentence instead of after all of it.
+    cancel works as for say().
+
+    returns metrics (seconds):
+
+        time_to_first_audio  call until playback of the first segment starts
+        gaps                 silence between the end of segment N and the
+                             start of N+1 (i.e. the player starved)
+        total                call until the last segment has been played
+    """
+    import queue
+    assert(isinstance(msg,str))
+    t_start = time.perf_counter()
+    if engine is None:
+        engine = default_engine()
+    if engine not in available_engines():
+        raise Exception("sorry, engine '{}' not available.".format(engine))
+    with _stage('text', engine):
+        segments = _split_sentences(msg)
+    metrics = {'segments': len(segments), 'time_to_first_audio': None, 'gaps': [], 'total': None}
+    if not _can_render(engine): # nothing to pipeline, engine speaks directly
+        for i, segment in enumerate(segments):
+            if i == 0:
+                metrics['time_to_first_audio'] = time.perf_counter() - t_start
+            say(segment, engine, use_cache)
+        metrics['total'] = time.perf_counter() - t_start
+        return metrics
+    rendered = queue.Queue(maxsize=lookahead)
+    stop = threading.Event()
+    def worker():
+        for segment in segments:
+            if stop.is_set():
+                break
+            try:
+                audio = _synthesize(segment, engine, use_cache)
+            except Exception as e:
+                rendered.put(e)
+                return
+            rendered.put(audio)
+    t = threading.Thread(target=worker, daemon=True)
+    t.start()
+    t_end_prev = None
+    try:
+        for i in range(len(segments)):
+            audio = rendered.get()
+            if isinstance(audio, Exception):
+                raise audio
+            t_play = time.perf_counter()
+            if t_end_prev is None:
+                metrics['time_to_first_audio'] = t_play - t_start
+            else:
+                metrics['gaps'].append(t_play - t_end_prev)
+            try:
+                _play_audio(audio, engine=engine, cancel=cancel)
+            except Interrupted as e:
+                if i and not e.started: # earlier segments were played already
+                    raise Interrupted(str(e), started=True)
+                raise
+            t_end_prev = time.perf_counter()
+    finally:
+        stop.set()
+        while t.is_alive(): # unblock the worker
+            try:
+                rendered.get(timeout=0.1)
+            except queue.Empty:
+                pass
+    metrics['total'] = time.perf_counter() - t_start
+    logger.debug("say_stream metrics: {}".format(metrics))
+    return metrics
+
+
+def say(msg, engine=None, use_cache=True, stream=False, cancel=None):
+    """
+    speaks msg using engine.
+
+    if the audio cache is enabled the rendered audio is looked up by
+    (engine, lang, normalized text) first and replayed directly on a hit.
+    with stream=True long texts are synthesized and played sentence by
+    sentence (see say_stream()). setting the threading.Event cancel stops
+    the playback, or prevents it if synthesis isn't done yet (see
+    _play_audio()).
+    """
+    assert(isinstance(msg,str))
+    tts_cmd = None
+    if engine is None:
+        engine = default_engine()
+    if engine not in available_engines():
+        raise Exception("sorry, engine '{}' not available.".format(engine))
+    try:
+        with _stage('total', engine):
+            if stream:
+                say_stream(msg, engine, use_cache, cancel=cancel)
+                return True
+            if _can_render(engine):
+                return _play_audio(_take_prefetched(msg, engine) or _synthesize(msg, engine, use_cache), engine=engine, cancel=cancel)
+            if engine == 'festival':
+                tts_cmd = ['festival', '--tts']
+            elif engine == 'espeak':
+                tts_cmd = ['espeak', '--stdin']
+            if tts_cmd:
+                with _stage('direct', engine): # engine speaks itself
+                    subprocess.run(tts_cmd, input=msg.encode('utf-8'))
+            else:
+                raise Exception("whooops. Sry, no tts_cmd for engine='{}'".format(engine))
+    finally:
+        metrics_flush()
+
+
+# --- prefetch
+# audio which will probably be needed soon (e.g. both replies of ask while the
+# question is still spoken) can be synthesized in the background. say() of a
+# prefetched message then only waits for (or just takes) the result.
+
+PREFETCH_WORKERS = 2
+_prefetched = {} # (engine, msg) -> future of _synthesize()
+_prefetch_lock = threading.Lock()
+_prefetch_executor = None
+
+
+def prefetch(msg, engine=None, use_cache=True):
+    """
+    starts synthesizing msg in the background. returns the future of the
+    audio or None if engine can't render (it speaks itself).
+    """
+    global _prefetch_executor
+    if engine is None:
+        engine = default_engine()
+    if not _can_render(engine):
+        return None
+    with _prefetch_lock:
+        future = _prefetched.get((engine, msg))
+        if future is None:
+            if _prefetch_executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                _prefetch_executor = ThreadPoolExecutor(PREFETCH_WORKERS, thread_name_prefix='say-prefetch')
+            future = _prefetched[(engine, msg)] = _prefetch_executor.submit(_synthesize, msg, engine, use_cache)
+    return future
+
+
+def _take_prefetched(msg, engine):
+    """
+    returns the prefetched audio of msg (waiting for it if still in progress)
+    or None if it wasn't prefetched or failed.
+    """
+    with _prefetch_lock:
+        future = _prefetched.pop((engine, msg), None)
+    if future is None:
+        return None
+    try:
+        with _stage('prefetch_wait', engine):
+            return future.result()
+    except Exception as e:
+        logger.warning("prefetching '{}' failed: {}".format(msg, e))
+        return None
+
+
+def discard_prefetched(msg=None, engine=None):
+    """
+    forgets prefetched audio (of msg or all) which wasn't spoken. a synthesis
+    not yet started is cancelled, finished ones stay in the audio cache.
+    """
+    with _prefetch_lock:
+        for key in list(_prefetched):
+            if (msg is None or key[1] == msg) and (engine is None or key[0] == engine):
+                _prefetched.pop(key).cancel()
+
+
+def speak_reply(msg, engine=None, t_answer=None):
+    """
+    speaks msg as the reply to an answer given at t_answer (time.perf_counter())
+    and reports the latency from the answer until the reply starts playing.
+    returns the latency in seconds (None if unknown, e.g. spoken by the daemon).
+    """
+    if t_answer is None:
+        t_answer = time.perf_counter()
+    started = []
+    def on_stage(stage, engine, seconds, error):
+        if stage == 'player_start' and not started:
+            started.append(time.perf_counter())
+    add_stage_hook(on_stage)
+    try:
+        speak(msg, engine)
+    finally:
+        remove_stage_hook(on_stage)
+    latency = started[0] - t_answer if started else None
+    if latency is None:
+        logger.info("reply latency: unknown (not played in-process)")
+    else:
+        logger.info("reply latency: {:.0f}ms".format(latency * 1000))
+        metrics_gauge('say_reply_latency_seconds', latency)
+        metrics_flush()
+    return latency
+
+
+# --- multiple segments
+# say_many() speaks segments (of maybe different engines) as one clip: they
+# are synthesized concurrently, decoded to mono s16le pcm of one rate and
+# joined, so they play back-to-back without gaps. no audioop (gone in 3.13):
+# wavs are converted with array, mp3s decoded by ffmpeg (or pygame).
+
+SAY_MANY_WORKERS = 4
+
+
+def _resample(samples, rate_in, rate_out):
+    """linear interpolation of an array('h')."""
+    from array import array
+    if rate_in == rate_out or not samples:
+        return samples
+    n = int(len(samples) * rate_out / rate_in)
+    step = rate_in / rate_out
+    last = len(samples) - 1
+    out = array('h', bytes(2 * n))
+    for i in range(n):
+        pos = i * step
+        j = int(pos)
+        if j >= last:
+            out[i] = samples[last]
         else:
-            raise Exception("whooops. Sry, no tts_cmd for engine='{}'".format(engine))
+            out[i] = int(samples[j] + (samples[j + 1] - samples[j]) * (pos - j))
+    return out
+
+
+def _normalize_pcm(frames, width, channels, rate_in, rate):
+    """converts little-endian pcm frames to mono s16le at rate."""
+    from array import array
+    if width == 1: # unsigned 8 bit
+        samples = array('h', [(b - 128) << 8 for b in frames])
+    elif width == 2:
+        samples = array('h', frames)
+        if sys.byteorder == 'big':
+            samples.byteswap()
     else:
-        _play_audio(fn_audio)
-        if DELETE_AUDIO_FILES: os.remove(fn_audio)
+        raise Exception("sorry, {} bit audio is not supported".format(width * 8))
+    if channels > 1:
+        samples = array('h', [sum(samples[i:i + channels]) // channels for i in range(0, len(samples), channels)])
+    samples = _resample(samples, rate_in, rate)
+    if sys.byteorder == 'big':
+        samples.byteswap()
+    return samples.tobytes()
+
+
+def _to_pcm(audio, rate):
+    """decodes audio (a path or encoded bytes) to mono s16le pcm at rate."""
+    import io
+    import wave
+    if isinstance(audio, str):
+        with open(audio, 'rb') as fh:
+            audio = fh.read()
+    if _sniff_format(audio) == 'wav':
+        with wave.open(io.BytesIO(audio)) as w:
+            return _normalize_pcm(w.readframes(w.getnframes()), w.getsampwidth(), w.getnchannels(), w.getframerate(), rate)
+    if _has_binary('ffmpeg'):
+        return subprocess.run(['ffmpeg', '-loglevel', 'error', '-i', '-', '-f', 's16le', '-ac', '1', '-ar', str(rate), '-'],
+                              input=audio, stdout=subprocess.PIPE, check=True).stdout
+    pygame = _get_pygame()
+    if not pygame:
+        raise Exception("sorry, decoding mp3 needs ffmpeg or pygame")
+    if not pygame.mixer.get_init():
+        pygame.mixer.init(frequency=rate, size=-16, channels=1)
+    frequency, size, channels = pygame.mixer.get_init()
+    raw = pygame.mixer.Sound(file=io.BytesIO(audio)).get_raw()
+    return _normalize_pcm(raw, abs(size) // 8, channels, frequency, rate)
+
+
+def say_many(segments, use_cache=True, rate=MIXER_FREQUENCY):
+    """
+    speaks segments [(text, engine), ...] back-to-back without gaps. all
+    segments are synthesized concurrently and played as one clip. engine None
+    means the default engine.
+
+    returns {'segments', 'duration' (sum of the segment durations), 'ready'
+    (seconds until the clip was ready to play), 'wall'} (seconds).
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    t_start = time.perf_counter()
+    segments = [(text, engine or default_engine()) for text, engine in segments]
+    for text, engine in segments:
+        assert(isinstance(text,str))
+        if engine not in available_engines():
+            raise Exception("sorry, engine '{}' not available.".format(engine))
+    report = {'segments': len(segments), 'duration': 0.0, 'ready': 0.0, 'wall': 0.0}
+    if not segments:
+        return report
+    if not all(_can_render(engine) for text, engine in segments):
+        logger.warning("say_many: not every engine can render into memory. speaking the segments one by one.")
+        for text, engine in segments:
+            say(text, engine, use_cache)
+        report['wall'] = time.perf_counter() - t_start
+        return report
+    def render(segment):
+        text, engine = segment
+        audio = _take_prefetched(text, engine) or _synthesize(text, engine, use_cache)
+        with _stage('normalize', engine):
+            return _to_pcm(audio, rate)
+    try:
+        with _stage('total', 'many'):
+            with ThreadPoolExecutor(min(len(segments), SAY_MANY_WORKERS), thread_name_prefix='say-many') as pool:
+                pcm = list(pool.map(render, segments))
+            report['duration'] = sum(len(p) for p in pcm) / (2.0 * rate)
+            report['ready'] = time.perf_counter() - t_start
+            _play_audio(_pcm_to_wav(b''.join(pcm), rate), engine='many')
+    finally:
+        metrics_flush()
+    report['wall'] = time.perf_counter() - t_start
+    logger.info("say_many: {} segments, {:.2f}s of audio in {:.2f}s (ready after {:.2f}s)".format(
+        report['segments'], report['duration'], report['wall'], report['ready']))
+    return report
+
+
+# --- asyncio
+# asay() is say() for event loops: engines run as asyncio subprocesses (gTTS
+# in the default executor) and playback is awaited without blocking the loop.
+# concurrent calls synthesize in parallel but play strictly in the order they
+# were started. cancelling a call kills its synthesis and stops its playback.
+
+class _PlaybackOrder:
+    """hands out tickets and lets the holders play one after another."""
+    def __init__(self):
+        import asyncio
+        self._next_ticket = 0
+        self._serving = 0
+        self._finished = set()
+        self._cond = asyncio.Condition()
+
+    def ticket(self):
+        t = self._next_ticket
+        self._next_ticket += 1
+        return t
+
+    async def wait_turn(self, t):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._serving == t)
+
+    async def release(self, t):
+        """marks t as done (played, failed or cancelled) so later tickets can proceed."""
+        async with self._cond:
+            self._finished.add(t)
+            while self._serving in self._finished:
+                self._finished.remove(self._serving)
+                self._serving += 1
+            self._cond.notify_all()
+
+
+_playback_orders = None
+def _get_playback_order():
+    import asyncio
+    import weakref
+    global _playback_orders
+    if _playback_orders is None:
+        _playback_orders = weakref.WeakKeyDictionary()
+    loop = asyncio.get_running_loop()
+    if loop not in _playback_orders:
+        _playback_orders[loop] = _PlaybackOrder()
+    return _playback_orders[loop]
+
+
+async def _arun(cmd, msg):
+    """runs cmd with msg on stdin, returns its stdout. the process is killed on cancellation."""
+    import asyncio
+    proc = await asyncio.create_subprocess_exec(*cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                                stderr=subprocess.DEVNULL)
+    try:
+        out, _ = await proc.communicate(msg.encode('utf-8'))
+    except asyncio.CancelledError:
+        proc.kill()
+        await proc.wait()
+        raise
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+    return out
+
+
+async def _asynthesize(msg, engine, use_cache=True):
+    """async version of _synthesize()."""
+    import asyncio
+    loop = asyncio.get_running_loop()
+    suffix = _AUDIO_SUFFIX[engine]
+    cache = get_cache() if use_cache else None
+    if cache:
+        with _stage('cache_lookup', engine):
+            key = cache.key(engine, msg, LANG_DEFAULT)
+            audio = await loop.run_in_executor(None, cache.get, key, suffix)
+        if audio is not None:
+            return audio
+    with _stage('synthesize', engine):
+        if engine in _RENDER_CMDS and not get_remote_workers() and not _worker(engine):
+            audio = await _arun(_RENDER_CMDS[engine], msg) # no thread needed for a subprocess
+        else: # remote or persistent workers, see _render_bytes()
+            audio = await loop.run_in_executor(None, _render_bytes, msg, engine, LANG_DEFAULT, use_cache)
+    if cache:
+        with _stage('cache_store', engine):
+            await loop.run_in_executor(None, cache.put, key, suffix, audio)
+    return audio
+
+
+async def _aplay(audio, sink=None, engine=None):
+    """async version of _play_audio(), also raises Interrupted if stopped by stop_playback()."""
+    import asyncio
+    with _stage('player_start', engine):
+        playback = (sink or get_sink()).play(audio)
+    with _playing_lock:
+        _playing[playback] = False
+    try:
+        with _stage('playback', engine):
+            try:
+                while not playback.done():
+                    await asyncio.sleep(0.01)
+            except asyncio.CancelledError:
+                playback.stop()
+                raise
+            ok = playback.wait()
+    finally:
+        with _playing_lock:
+            stopped = _playing.pop(playback)
+    if stopped:
+        raise Interrupted("playback stopped")
+    return ok
+
+
+async def asay(msg, engine=None, use_cache=True, timeout=None):
+    """
+    speaks msg without blocking the event loop. returns True if playback succeeded.
+
+    raises asyncio.TimeoutError if synthesis and playback together take longer
+    than timeout seconds, the utterance is stopped in that case. raises
+    Interrupted if stopped by stop_playback().
+    """
+    import asyncio
+    assert(isinstance(msg,str))
+    if engine is None:
+        engine = default_engine()
+    if engine not in available_engines():
+        raise Exception("sorry, engine '{}' not available.".format(engine))
+    order = _get_playback_order()
+    ticket = order.ticket() # taken right away, so calls play in the order they were made
+    async def run():
+        if _can_render(engine):
+            audio = await _asynthesize(msg, engine, use_cache)
+            await order.wait_turn(ticket)
+            return await _aplay(audio, engine=engine)
+        await order.wait_turn(ticket) # festival without text2wave speaks directly
+        await _arun(['festival', '--tts'], msg)
+        return True
+    try:
+        if timeout is None:
+            return await run()
+        return await asyncio.wait_for(run(), timeout)
+    finally: # also if wait_for() cancelled run() before it even started
+        await order.release(ticket)
+
+
+# --- follow mode
+# `say --follow` speaks stdin line by line as it streams in. lines wait in a
+# bounded buffer between the reader and the speaker, what happens when the
+# buffer is full is up to the backpressure policy:
+#
+#   block        stop reading stdin (the writer blocks on the pipe)
+#   drop-oldest  discard the oldest pending line
+#   coalesce     speak everything pending as one summary utterance
+#
+# either way memory stays flat no matter how fast the input arrives.
+
+BACKPRESSURE_POLICIES = ['block', 'drop-oldest', 'coalesce']
+FOLLOW_QUEUE_SIZE = 8
+COALESCE_TEMPLATE = "{n} new messages. latest: {last}"
+
+class _FollowBuffer:
+    def __init__(self, maxsize=FOLLOW_QUEUE_SIZE, policy='block'):
+        import collections
+        assert(policy in BACKPRESSURE_POLICIES)
+        assert(maxsize > 0)
+        self.maxsize = maxsize
+        self.policy = policy
+        self.lines = collections.deque()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+        self.coalesced = 0
+        self._skipped = 0 # lines pushed out of the buffer, summarized by the next coalesce
+
+    def put(self, line):
+        with self.cond:
+            if self.policy == 'block':
+                while len(self.lines) >= self.maxsize:
+                    self.cond.wait()
+            elif len(self.lines) >= self.maxsize:
+                self.lines.popleft()
+                if self.policy == 'coalesce':
+                    self._skipped += 1
+                else:
+                    self.dropped += 1
+            self.lines.append(line)
+            self.cond.notify_all()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def get(self):
+        """returns the next message to speak or None if the input is exhausted."""
+        with self.cond:
+            while not self.lines and not self.closed:
+                self.cond.wait()
+            if not self.lines:
+                return None
+            if self.policy == 'coalesce' and (len(self.lines) > 1 or self._skipped):
+                n = len(self.lines) + self._skipped
+                msg = COALESCE_TEMPLATE.format(n=n, last=self.lines[-1])
+                self.coalesced += n
+                self.lines.clear()
+                self._skipped = 0
+            else:
+                msg = self.lines.popleft()
+            self.cond.notify_all()
+            return msg
+
+
+def follow(stream=sys.stdin, engine=None, use_cache=True, backpressure='block', maxsize=FOLLOW_QUEUE_SIZE, sock_path=None, priority=None):
+    """
+    speaks every line read from stream until EOF.
+
+    a reader thread fills a bounded buffer (see BACKPRESSURE_POLICIES), a
+    synthesis thread renders the next message while the current one plays.
+    if sock_path is given and a say-daemon listens there, the messages are
+    handed over to it instead (with priority).
+
+    returns counters {'read', 'spoken', 'dropped', 'coalesced'}.
+    """
+    import queue
+    if engine is None:
+        engine = default_engine()
+    use_daemon = sock_path is not None and _daemon_request({'ping': True}, sock_path) is not None
+    if not use_daemon:
+        start_workers([engine])
+    buf = _FollowBuffer(maxsize, backpressure)
+    stats = {'read': 0, 'spoken': 0}
+    def reader():
+        try:
+            for line in iter(stream.readline, ''): # no read-ahead, unlike `for line in stream`
+                line = line.strip()
+                if line:
+                    stats['read'] += 1
+                    buf.put(line)
+        finally:
+            buf.close()
+    rendered = queue.Queue(maxsize=1)
+    def synthesizer():
+        while True:
+            msg = buf.get()
+            if msg is None:
+                rendered.put(None)
+                break
+            audio = None
+            if not use_daemon and _can_render(engine):
+                try:
+                    audio = _synthesize(msg, engine, use_cache)
+                except Exception as e:
+                    logger.error("synthesizing '{}' failed: {}".format(msg, e))
+                    continue
+            rendered.put((msg, audio))
+    threading.Thread(target=reader, daemon=True).start()
+    threading.Thread(target=synthesizer, daemon=True).start()
+    while True:
+        item = rendered.get()
+        if item is None:
+            break
+        msg, audio = item
+        try:
+            if use_daemon:
+                speak(msg, engine, use_cache, sock_path=sock_path, priority=priority)
+            elif audio:
+                _play_audio(audio)
+            else:
+                say(msg, engine, use_cache)
+            stats['spoken'] += 1
+        except Exception as e:
+            logger.error("speaking '{}' failed: {}".format(msg, e))
+    stats['dropped'] = buf.dropped
+    stats['coalesced'] = buf.coalesced
+    for k, v in stats.items():
+        metrics_gauge('say_follow_' + k, v)
+    metrics_flush()
+    logger.debug("follow stats: {}".format(stats))
+    return stats
+
+
+# --- bulk rendering
+# `say --render-to DIR MANIFEST` renders many prompts into audio files instead
+# of speaking them. the manifest is either plain text (one prompt per line)
+# or json-lines with the keys text, engine (optional) and output (optional,
+# file name relative to DIR). items are rendered by a pool of processes,
+# outputs which already exist are skipped so an interrupted run can simply
+# be restarted.
+
+def _slug(text, max_len=40):
+    slug = re.sub(r'[^a-z0-9]+', '-', text.lower()).strip('-')
+    return slug[:max_len].rstrip('-') or 'prompt'
+
+
+def read_manifest(fn, engine=None):
+    """
+    returns the items [{'text', 'engine', 'output'}, ...] of manifest fn ('-'
+    is stdin). items which can't be rendered (bad json, no text, an output
+    outside of the output directory) get an 'error' instead.
+    """
+    fh = sys.stdin if fn == '-' else open(fn)
+    items = []
+    try:
+        for i, line in enumerate(fh):
+            line = line.strip()
+            if not line:
+                continue
+            where = "manifest '{}' line {}".format(fn, i + 1)
+            if line.startswith('{'):
+                try:
+                    item = json.loads(line)
+                except ValueError as e:
+                    items.append({'output': where, 'error': "{}: {}".format(where, e)})
+                    continue
+                if not isinstance(item, dict) or not isinstance(item.get('text'), str) or not item['text'].strip():
+                    items.append({'output': where, 'error': "{}: 'text' must be a non-empty string".format(where)})
+                    continue
+            else:
+                item = {'text': line}
+            item.setdefault('engine', engine or default_engine())
+            if not isinstance(item['engine'], str) or not isinstance(item.get('output', ''), str):
+                items.append({'output': where, 'error': "{}: 'engine' and 'output' must be strings".format(where)})
+                continue
+            suffix = _AUDIO_SUFFIX.get(item['engine'], '.wav')
+            item.setdefault('output', '{:05d}-{}{}'.format(i + 1, _slug(item['text']), suffix))
+            output = item['output']
+            if os.path.isabs(output) or os.path.normpath(output).split(os.sep)[0] == os.pardir:
+                items.append({'output': output, 'error': "{}: output '{}' is outside of the output directory".format(where, output)})
+                continue
+            if not os.path.splitext(output)[1]:
+                output += suffix
+            item['output'] = output
+            items.append(item)
+    finally:
+        if fh is not sys.stdin:
+            fh.close()
+    return items
+
+
+def _render_item(item, out_dir):
+    """renders one manifest item. runs in a worker process."""
+    fn_out = os.path.join(out_dir, item['output'])
+    fn_tmp = os.path.join(os.path.dirname(fn_out), '.tmp-' + os.path.basename(fn_out))
+    t_start = time.perf_counter()
+    try:
+        os.makedirs(os.path.dirname(fn_out), exist_ok=True)
+        _render(item['text'], item['engine'], fn_tmp)
+        os.replace(fn_tmp, fn_out) # never leave half-written outputs for a resumed run
+        return {'output': fn_out, 'seconds': time.perf_counter() - t_start, 'bytes': os.path.getsize(fn_out), 'error': None}
+    except Exception as e:
+        if os.path.exists(fn_tmp): os.remove(fn_tmp)
+        return {'output': fn_out, 'seconds': time.perf_counter() - t_start, 'bytes': 0, 'error': str(e)}
+
+
+def render_manifest(manifest, out_dir, engine=None, jobs=None):
+    """
+    renders all items of the manifest into out_dir using `jobs` processes
+    (default: one per cpu). returns a report with per-item timings and the
+    overall throughput.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    items = read_manifest(manifest, engine)
+    engines = available_engines()
+    todo, report = [], {'rendered': 0, 'skipped': 0, 'failed': 0, 'bytes': 0, 'items': []}
+    for item in items:
+        if item.get('error'):
+            logger.error(item['error'])
+            report['items'].append({'output': item['output'], 'seconds': 0.0, 'bytes': 0, 'error': item['error']})
+            report['failed'] += 1
+        elif os.path.exists(os.path.join(out_dir, item['output'])):
+            report['skipped'] += 1
+        elif item['engine'] not in engines or not _can_render(item['engine']):
+            error = "engine '{}' can't render '{}'".format(item['engine'], item['output'])
+            logger.error(error + ". skipping.")
+            report['items'].append({'output': item['output'], 'seconds': 0.0, 'bytes': 0, 'error': error})
+            report['failed'] += 1
+        else:
+            todo.append(item)
+    logger.info("rendering {} items into '{}' ({} already done)".format(len(todo), out_dir, report['skipped']))
+    t_start = time.perf_counter()
+    if todo:
+        with ProcessPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+            futures = [pool.submit(_render_item, item, out_dir) for item in todo]
+            for f in as_completed(futures):
+                r = f.result()
+                report['items'].append(r)
+                if r['error']:
+                    report['failed'] += 1
+                    logger.error("FAILED {} after {:.2f}s: {}".format(r['output'], r['seconds'], r['error']))
+                else:
+                    report['rendered'] += 1
+                    report['bytes'] += r['bytes']
+                    logger.info("ok {:.2f}s {}".format(r['seconds'], r['output']))
+    report['wall_seconds'] = time.perf_counter() - t_start
+    report['items_per_second'] = report['rendered'] / report['wall_seconds'] if report['wall_seconds'] > 0 else 0.0
+    return report
+
+
+# --- daemon
+# `say --serve` keeps one process with probed engines, imported modules and
+# the cache open. clients send one json-line per request over a unix socket
+# and (unless wait is false) get their reply when the message has been spoken.
+# a single speaker thread works through the requests (see SpeechQueue) so
+# concurrent callers no longer talk over each other.
+
+PRIORITIES = {'low': 0, 'normal': 1, 'high': 2, 'urgent': 3}
+PREEMPT_PRIORITY = 'urgent' # messages of this priority stop the playback of less important ones
+DEDUP_WINDOW = float(os.environ.get('SAY_DEDUP_WINDOW', 30)) # seconds an identical pending message is merged
+QUEUE_TTL = float(os.environ.get('SAY_QUEUE_TTL', 300)) # seconds a message may wait before it is dropped as stale
+
+
+def _priority(priority):
+    """returns the level of a priority given by name or number."""
+    if priority is None:
+        return PRIORITIES['normal']
+    if isinstance(priority, str) and priority in PRIORITIES:
+        return PRIORITIES[priority]
+    if isinstance(priority, int) and not isinstance(priority, bool):
+        return priority
+    raise ValueError("unknown priority '{}' (one of {})".format(priority, list(PRIORITIES)))
+
+
+def _ttl(ttl):
+    """returns the seconds a message may wait (QUEUE_TTL if ttl is None)."""
+    if ttl is None:
+        return QUEUE_TTL
+    if isinstance(ttl, bool) or not isinstance(ttl, (int, float)) or not ttl >= 0:
+        raise ValueError("ttl must be a number of seconds >= 0, not '{}'".format(ttl))
+    return ttl
+
+
+class _Utterance:
+    def __init__(self, msg, engine=None, use_cache=True, stream=False, priority=None, ttl=None):
+        self.msg = msg
+        self.engine = engine
+        self.use_cache = use_cache
+        self.stream = stream
+        self.priority = _priority(priority)
+        self.t_submit = time.monotonic()
+        self.t_expire = self.t_submit + _ttl(ttl)
+        self.entry = None # its current entry in the heap of SpeechQueue
+        self.merged = 0 # nr. of identical messages merged into this one
+        self.error = None
+        self.preempted = threading.Event() # set by SpeechQueue.put(), see SayDaemon._speaker()
+        self.preempted_by = None
+        self.done = threading.Event()
+
+
+class SpeechQueue:
+    """
+    pending utterances, the most important first (then in arrival order).
+
+    - an identical message (same text & engine) submitted within DEDUP_WINDOW
+      of a pending or playing one is merged into it instead of being queued
+    - a message which waited longer than its ttl is dropped as stale
+    - a message of PREEMPT_PRIORITY stops the playback of a less important one
+
+    depth, merged/expired/preempted counters and the wait times are exposed as
+    metrics (say_queue_* gauges, stage 'queue_wait').
+    """
+    def __init__(self, dedup_window=DEDUP_WINDOW):
+        import itertools
+        self.dedup_window = dedup_window
+        self.heap = []
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.pending = {} # (msg, engine) -> utterance
+        self.current = None
+        self.closed = False
+        self.counters = {'submitted': 0, 'deduplicated': 0, 'expired': 0, 'preempted': 0}
+
+    def _push(self, u):
+        import heapq
+        u.entry = (-u.priority, next(self.seq), u)
+        heapq.heappush(self.heap, u.entry)
+
+    def _gauges(self):
+        metrics_gauge('say_queue_depth', len(self.pending))
+        for k, v in self.counters.items():
+            metrics_gauge('say_queue_{}_total'.format(k), v)
+
+    def put(self, u):
+        """queues u. returns the utterance which will speak it (u or the one it was merged into)."""
+        key = (u.msg, u.engine)
+        preempt = False
+        with self.cond:
+            self.counters['submitted'] += 1
+            twin = self.pending.get(key)
+            if twin is None and self.current and (self.current.msg, self.current.engine) == key:
+                twin = self.current
+            if twin is not None and u.t_submit - twin.t_submit <= self.dedup_window:
+                twin.merged += 1
+                twin.t_expire = max(twin.t_expire, u.t_expire)
+                if u.priority > twin.priority and twin is not self.current:
+                    twin.priority = u.priority
+                    self._push(twin) # the old entry is skipped in get()
+                self.counters['deduplicated'] += 1
+                u = twin
+            else:
+                self.pending[key] = u
+                self._push(u)
+                self.cond.notify()
+            if (self.current and u is not self.current and u.priority >= PRIORITIES[PREEMPT_PRIORITY]
+                    and self.current.priority < u.priority and not self.current.preempted.is_set()):
+                self.current.preempted_by = u.priority
+                self.current.preempted.set() # stops its playback, or keeps it from starting
+                self.counters['preempted'] += 1
+                preempt = True
+            self._gauges()
+        if preempt:
+            stop_playback()
+        return u
+
+    def get(self):
+        """returns the next utterance to speak (None once closed). drops stale ones."""
+        import heapq
+        with self.cond:
+            while True:
+                while not self.heap and not self.closed:
+                    self.cond.wait()
+                if not self.heap:
+                    return None
+                entry = heapq.heappop(self.heap)
+                u = entry[2]
+                if entry is not u.entry: # re-queued with a higher priority
+                    continue
+                del self.pending[(u.msg, u.engine)]
+                now = time.monotonic()
+                if metrics_enabled():
+                    _metrics.observe('queue_wait', u.engine, now - u.t_submit)
+                if now > u.t_expire:
+                    u.error = "expired after {:.1f}s in the queue".format(now - u.t_submit)
+                    self.counters['expired'] += 1
+                    self._gauges()
+                    u.done.set()
+                    continue
+                self.current = u
+                self._gauges()
+                return u
+
+    def requeue(self, u):
+        """puts the current utterance u back, e.g. if it was preempted before it started playing."""
+        with self.cond:
+            if self.current is u:
+                self.current = None
+            u.preempted.clear()
+            u.preempted_by = None
+            self.pending.setdefault((u.msg, u.engine), u)
+            self._push(u)
+            self._gauges()
+            self.cond.notify()
+
+    def task_done(self, u):
+        with self.cond:
+            if self.current is u:
+                self.current = None
+        u.done.set()
+        metrics_flush()
+
+    def qsize(self):
+        with self.cond:
+            return len(self.pending)
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+class JsonLineServer:
+    """
+    unix socket server of the say-daemon and the xask kiosk: a client sends
+    one json line, handle(req, conn) (called in a thread per connection)
+    returns the reply which is sent back as one json line. a connection
+    closed without a request is a ping (see json_line_request()).
+    """
+    def __init__(self, sock_path, handle, name):
+        self.sock_path = sock_path
+        self.handle = handle
+        self.name = name
+        self._sock = None
+
+    def listen(self):
+        """raises if another server is listening on sock_path already."""
+        if json_line_request({'ping': True}, self.sock_path, self.name) is not None:
+            raise Exception("{} already listening on '{}'".format(self.name, self.sock_path))
+        if os.path.exists(self.sock_path): # stale socket of a crashed server
+            os.remove(self.sock_path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(self.sock_path)
+        os.chmod(self.sock_path, 0o600)
+        self._sock.listen(16)
+        logger.info("{} listening on '{}'".format(self.name, self.sock_path))
+        return self
+
+    def _serve(self, conn):
+        with conn, conn.makefile('rwb') as fh:
+            line = fh.readline()
+            if not line: # ping
+                return
+            try:
+                req = json.loads(line.decode('utf-8'))
+                if not isinstance(req, dict):
+                    raise ValueError("request must be a json object")
+                reply = self.handle(req, conn)
+            except (ValueError, KeyError) as e:
+                reply = {'ok': False, 'error': 'bad request: {}'.format(e)}
+            try:
+                fh.write((json.dumps(reply) + '\n').encode('utf-8'))
+                fh.flush()
+            except OSError: # client went away
+                pass
+
+    def serve_forever(self):
+        """accepts connections until close()."""
+        sock = self._sock
+        while True:
+            try:
+                conn, _ = sock.accept()
+            except OSError: # closed
+                break
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def close(self):
+        sock, self._sock = self._sock, None
+        if sock:
+            try:
+                sock.shutdown(socket.SHUT_RDWR) # wakes up serve_forever() blocked in accept()
+            except OSError:
+                pass
+            sock.close()
+            os.remove(self.sock_path)
+
+
+def json_line_request(req, sock_path, name='server'):
+    """
+    sends req to the JsonLineServer on sock_path and returns its reply.
+    returns None if nothing is listening on sock_path. a request {'ping':
+    True} only checks that.
+    """
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(sock_path)
+    except OSError:
+        s.close()
+        return None
+    with s, s.makefile('rwb') as fh:
+        if req.get('ping'):
+            return {'ok': True}
+        fh.write((json.dumps(req) + '\n').encode('utf-8'))
+        fh.flush()
+        line = fh.readline()
+    if not line:
+        raise Exception("{} on '{}' closed the connection".format(name, sock_path))
+    return json.loads(line.decode('utf-8'))
+
+
+class SayDaemon:
+    def __init__(self, sock_path=DAEMON_SOCKET):
+        self.sock_path = sock_path
+        self.queue = SpeechQueue()
+        self._server = None
+
+    def _warm_up(self):
+        engines = available_engines()
+        logger.info("say-daemon: available engines: {}".format(engines))
+        get_cache()
+        if 'google' in engines:
+            _get_gtts()
+        start_workers(engines)
+        logger.info("say-daemon: audio output: {}".format(get_sink().__class__.__name__))
+
+    def _speaker(self):
+        while True:
+            u = self.queue.get()
+            if u is None:
+                break
+            engine = u.engine or default_engine() # the client didn't choose
+            if engine not in available_engines():
+                logger.info("requested engine='{}' not available. using engine '{}' instead".format(engine, default_engine()))
+                engine = default_engine()
+            try:
+                say(u.msg, engine, use_cache=u.use_cache, stream=u.stream, cancel=u.preempted)
+            except Interrupted as e:
+                if not e.started: # preempted while it was synthesized: speak it after the more important one
+                    logger.info("say-daemon: '{}' preempted before playback. requeued.".format(u.msg))
+                    self.queue.requeue(u)
+                    continue
+                u.error = "preempted by a message of priority {}".format(u.preempted_by)
+                logger.info("say-daemon: '{}' {}".format(u.msg, u.error))
+            except Exception as e:
+                logger.error("say-daemon: speaking '{}' failed: {}".format(u.msg, e))
+                u.error = str(e)
+            self.queue.task_done(u)
+
+    def submit(self, msg, engine=None, use_cache=True, stream=False, priority=None, ttl=None):
+        """queues msg. returns the utterance which will speak it (see SpeechQueue.put())."""
+        return self.queue.put(_Utterance(msg, engine, use_cache, stream, priority, ttl))
+
+    def _handle(self, req, conn):
+        if not isinstance(req['msg'], str):
+            raise ValueError("msg must be a string")
+        u = self.submit(req['msg'], req.get('engine'), req.get('use_cache', True), req.get('stream', False),
+                        req.get('priority'), req.get('ttl'))
+        if req.get('wait', True):
+            u.done.wait()
+            return {'ok': u.error is None, 'error': u.error}
+        return {'ok': True, 'queued': self.queue.qsize()}
+
+    def serve_forever(self):
+        self._server = JsonLineServer(self.sock_path, self._handle, 'say-daemon').listen()
+        self._warm_up()
+        speaker = threading.Thread(target=self._speaker, daemon=True)
+        speaker.start()
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._server.close()
+            self.queue.close()
+
+
+def serve(sock_path=DAEMON_SOCKET):
+    """runs the say-daemon in the foreground."""
+    import signal
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    SayDaemon(sock_path).serve_forever()
+
+
+def _daemon_request(req, sock_path=DAEMON_SOCKET):
+    """
+    sends req to the daemon and returns its reply.
+    returns None if no daemon is listening on sock_path.
+    """
+    return json_line_request(req, sock_path, 'say-daemon')
+
+
+def speak(msg, engine=None, use_cache=True, wait=True, stream=False, sock_path=DAEMON_SOCKET, priority=None, ttl=None):
+    """
+    like say() but hands msg over to a running say-daemon if there is one
+    (queued by priority, see SpeechQueue). falls back to speaking in-process
+    otherwise.
+    """
+    assert(isinstance(msg,str))
+    _priority(priority)
+    _ttl(ttl)
+    if use_cache and get_cache(): # let a prefetch in progress fill the cache instead of rendering twice
+        _take_prefetched(msg, engine or default_engine())
+    reply = _daemon_request({'msg': msg, 'engine': engine, 'use_cache': use_cache, 'wait': wait, 'stream': stream,
+                             'priority': priority, 'ttl': ttl}, sock_path)
+    if reply is None:
+        logger.debug("no say-daemon on '{}'. speaking in-process.".format(sock_path))
+        return say(msg, engine, use_cache, stream)
+    if not reply['ok']:
+        raise Exception(reply['error'])
+    return True
+
+
+# --- remote synthesis workers
+# `say --worker` renders audio for other hosts, e.g. a server doing the work
+# for a fleet of raspberry pis. clients list the workers in
+# SAY_WORKERS=host:port,... and send every rendering job over tcp to the
+# least busy reachable one, rendering locally if none is. a frame is a 4 byte
+# (big endian) length, a json header and, if the header has a 'length', as
+# many bytes of payload. requests are {msg, engine, lang, use_cache}, replies
+# {ok, error, length, cached} followed by the encoded audio. connections are
+# kept open for further jobs. a worker renders through its own audio cache,
+# workers on one host can share it (SAY_CACHE_DIR), and the client caches the
+# result too. there is no authentication: trusted networks only.
+
+WORKER_PORT = 1315
+WORKER_LISTEN = '127.0.0.1:{}'.format(WORKER_PORT) # default address of `say --worker`
+REMOTE_WORKERS = [w.strip() for w in os.environ.get('SAY_WORKERS', '').split(',') if w.strip()]
+WORKER_CONNECT_TIMEOUT = 0.5 # seconds
+WORKER_TIMEOUT = 60 # seconds a job may take
+WORKER_RETRY_AFTER = 30 # seconds an unreachable worker is left alone
+_FRAME_HEADER_MAX = 1024 * 1024
+_FRAME_PAYLOAD_MAX = 256 * 1024 * 1024
+
+
+def _parse_address(address, default_port=WORKER_PORT):
+    host, sep, port = address.rpartition(':')
+    if not sep:
+        return address, default_port
+    return host.strip('[]'), int(port)
+
+
+def _send_frame(sock, header, payload=b''):
+    if payload:
+        header = dict(header, length=len(payload))
+    data = json.dumps(header).encode('utf-8')
+    sock.sendall(len(data).to_bytes(4, 'big') + data + payload)
+
+
+def _recv_exactly(sock, n):
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(min(n - len(buf), 1024 * 1024))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        buf += chunk
+    return bytes(buf)
+
+
+def _recv_frame(sock):
+    """returns (header, payload) or (None, None) if the peer closed the connection between frames."""
+    first = sock.recv(4)
+    if not first:
+        return None, None
+    size = int.from_bytes(first + _recv_exactly(sock, 4 - len(first)), 'big')
+    if size > _FRAME_HEADER_MAX:
+        raise ValueError("frame header of {} bytes too large".format(size))
+    header = json.loads(_recv_exactly(sock, size).decode('utf-8'))
+    length = header.get('length', 0)
+    if not 0 <= length <= _FRAME_PAYLOAD_MAX:
+        raise ValueError("payload of {} bytes too large".format(length))
+    return header, _recv_exactly(sock, length) if length else b''
+
+
+class RemoteWorker:
+    """a `say --worker` and the idle connections to it."""
+    def __init__(self, address):
+        self.address = address
+        self.host, self.port = _parse_address(address)
+        self.idle = []
+        self.active = 0 # jobs in progress
+        self.jobs = 0
+        self.failures = 0
+        self.down_until = 0.0 # monotonic
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=WORKER_CONNECT_TIMEOUT)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(WORKER_TIMEOUT)
+        return sock
+
+    def _job(self, sock, req):
+        _send_frame(sock, req)
+        header, payload = _recv_frame(sock)
+        if header is None:
+            raise ConnectionError("connection closed")
+        return header, payload
+
+    def render(self, req):
+        """
+        sends the job req. returns the reply (header, payload).
+        raises OSError/ValueError if the worker can't be reached or talked to.
+        """
+        with self.lock:
+            sock = self.idle.pop() if self.idle else None
+        if sock is not None:
+            try:
+                reply = self._job(sock, req)
+            except (OSError, ValueError): # kept too long, or the worker was restarted
+                sock.close()
+                sock = None
+        if sock is None:
+            sock = self._connect()
+            try:
+                reply = self._job(sock, req)
+            except (OSError, ValueError):
+                sock.close()
+                raise
+        with self.lock:
+            self.idle.append(sock)
+        return reply
+
+    def close(self):
+        with self.lock:
+            for sock in self.idle:
+                sock.close()
+            self.idle = []
+
+
+class RemoteWorkers:
+    """
+    balances rendering jobs over workers: the one with the fewest jobs in
+    progress first, ties broken round robin. unreachable workers are skipped
+    for WORKER_RETRY_AFTER seconds.
+    """
+    def __init__(self, addresses):
+        self.workers = [RemoteWorker(a) for a in addresses]
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self._next = 0
+
+    def _candidates(self):
+        now = time.monotonic()
+        with self.lock:
+            n = len(self.workers)
+            order = [self.workers[(self._next + i) % n] for i in range(n)]
+            self._next = (self._next + 1) % n
+        up = [w for w in order if w.down_until <= now]
+        return sorted(up, key=lambda w: w.active) # stable: round robin among equally busy ones
+
+    def render(self, msg, engine, lang=LANG_DEFAULT, use_cache=True):
+        """returns the audio rendered by a worker, None if none could render it."""
+        req = {'msg': msg, 'engine': engine, 'lang': lang, 'use_cache': use_cache}
+        for w in self._candidates():
+            with self.lock:
+                w.active += 1
+            try:
+                with _stage('remote', engine):
+                    header, payload = w.render(req)
+            except (OSError, ValueError) as e:
+                w.failures += 1
+                w.down_until = time.monotonic() + WORKER_RETRY_AFTER
+                logger.warning("say-worker {} unreachable ({}). skipping it for {}s.".format(w.address, e, WORKER_RETRY_AFTER))
+                continue
+            finally:
+                with self.lock:
+                    w.active -= 1
+            if not header.get('ok'):
+                logger.info("say-worker {} could not render '{}': {}".format(w.address, msg, header.get('error')))
+                continue
+            w.jobs += 1
+            logger.debug("rendered '{}' on say-worker {}{}".format(msg, w.address, ' (cached)' if header.get('cached') else ''))
+            return payload
+        return None
+
+    def stats(self):
+        return {w.address: {'jobs': w.jobs, 'failures': w.failures, 'up': w.down_until <= time.monotonic()}
+                for w in self.workers}
+
+
+_remote_workers = None
+_remote_workers_lock = threading.Lock()
+
+
+def get_remote_workers():
+    """returns the RemoteWorkers of REMOTE_WORKERS (None if there are none)."""
+    global _remote_workers
+    if not REMOTE_WORKERS:
+        return None
+    with _remote_workers_lock:
+        if _remote_workers is None or _remote_workers.pid != os.getpid(): # no sockets shared with a parent
+            _remote_workers = RemoteWorkers(REMOTE_WORKERS)
+        return _remote_workers
+
+
+class SynthesisWorker:
+    def __init__(self, address=WORKER_LISTEN):
+        self.address = address
+        self._server = None
+
+    def _warm_up(self):
+        global REMOTE_WORKERS
+        REMOTE_WORKERS = [] # render here, never pass jobs on (no loops)
+        engines = available_engines()
+        logger.info("say-worker: available engines: {}".format(engines))
+        get_cache()
+        if 'google' in engines:
+            _get_gtts()
+        start_workers(engines)
+
+    def _job(self, req):
+        msg, engine = req['msg'], req['engine']
+        if not isinstance(msg, str) or engine not in available_engines() or not _can_render(engine):
+            return {'ok': False, 'error': "engine '{}' not available".format(engine)}, b''
+        if req.get('lang', LANG_DEFAULT) != LANG_DEFAULT:
+            return {'ok': False, 'error': "lang '{}' not supported".format(req['lang'])}, b''
+        audio = _synthesize(msg, engine, req.get('use_cache', True))
+        return {'ok': True, 'cached': isinstance(audio, CachedAudio)}, audio
+
+    def _handle(self, conn):
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with conn:
+            while True:
+                try:
+                    req, _ = _recv_frame(conn)
+                except (OSError, ValueError) as e:
+                    logger.info("say-worker: dropping connection: {}".format(e))
+                    return
+                if req is None:
+                    return
+                try:
+                    header, audio = self._job(req)
+                except KeyError as e:
+                    header, audio = {'ok': False, 'error': 'bad request: missing {}'.format(e)}, b''
+                except Exception as e:
+                    logger.error("say-worker: rendering '{}' failed: {}".format(req.get('msg'), e))
+                    header, audio = {'ok': False, 'error': str(e)}, b''
+                try:
+                    _send_frame(conn, header, audio)
+                except OSError: # client went away
+                    return
+
+    def serve_forever(self):
+        self._warm_up()
+        host, port = _parse_address(self.address)
+        self._server = socket.create_server((host, port))
+        logger.info("say-worker listening on {}:{}".format(host, port))
+        try:
+            while True:
+                conn, _ = self._server.accept()
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._server.close()
+
+
+def serve_worker(address=WORKER_LISTEN):
+    """runs a synthesis worker in the foreground."""
+    import signal
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    SynthesisWorker(address).serve_forever()
 
 if __name__ == '__main__':
-    if not _check_requirements():
-        logger.critical('_check_requirements() failed.')
-        sys.exit(-1)
+    from docopt import docopt
     kwargs = docopt(__doc__, version=str('.'.join([str(el) for el in __version__])))
     logger.debug("kwargs={}".format(kwargs))
+    sock_path = kwargs['--socket'] or DAEMON_SOCKET
+    if kwargs['--cache-stats']:
+        print(json.dumps(cache_stats(), indent=2))
+        sys.exit(0)
+    if kwargs['--render-to']:
+        engine = kwargs['--engine'] if kwargs['--engine'] in available_engines() else default_engine()
+        report = render_manifest(kwargs['<manifest>'] or '-', kwargs['--render-to'], engine,
+                                 int(kwargs['--jobs']) if kwargs['--jobs'] else None)
+        logger.info("rendered {} items ({} skipped, {} failed, {} bytes) in {:.2f}s: {:.2f} items/s".format(
+            report['rendered'], report['skipped'], report['failed'], report['bytes'], report['wall_seconds'], report['items_per_second']))
+        sys.exit(1 if report['failed'] else 0)
+    if kwargs['--worker']:
+        serve_worker(kwargs['--listen'])
+        sys.exit(0)
+    if kwargs['--serve']:
+        if not _check_requirements():
+            logger.critical('_check_requirements() failed.')
+            sys.exit(-1)
+        serve(sock_path)
+        sys.exit(0)
     if '<msg>' in kwargs:
         msg = kwargs['<msg>']
     engine = kwargs['--engine']
-    if not engine in available_engines():
-        logger.info("requested --engine='{}' not available. using engine '{}' instead".format(engine,ENGINE_DEFAULT))
-        engine=ENGINE_DEFAULT
+    use_cache = not kwargs['--no-cache']
+    if kwargs['--priority'] not in PRIORITIES:
+        logger.critical("--priority must be one of {}".format(list(PRIORITIES)))
+        sys.exit(-1)
+    ttl = None
+    if kwargs['--ttl']:
+        try:
+            ttl = float(kwargs['--ttl'])
+        except ValueError:
+            ttl = -1
+        if not ttl >= 0:
+            logger.critical("--ttl must be a number of seconds >= 0")
+            sys.exit(-1)
+    if kwargs['--follow']:
+        if kwargs['--backpressure'] not in BACKPRESSURE_POLICIES:
+            logger.critical("--backpressure must be one of {}".format(BACKPRESSURE_POLICIES))
+            sys.exit(-1)
+        if engine is None:
+            engine = default_engine()
+        elif not engine in available_engines():
+            logger.info("requested --engine='{}' not available. using engine '{}' instead".format(engine,default_engine()))
+            engine=default_engine()
+        follow(sys.stdin, engine, use_cache, kwargs['--backpressure'], int(kwargs['--queue-size']),
+               sock_path=None if kwargs['--no-daemon'] else sock_path, priority=kwargs['--priority'])
+        sys.exit(0)
+    stream = kwargs['--stream']
     if not msg:
         if _VERBOSITY > 0:
             msg = input("what should i say? : ")
         else:
             msg = input()
-    say(msg,engine)
+    if not kwargs['--no-daemon']: # thin client: the daemon does the rest
+        reply = _daemon_request({'msg': msg, 'engine': engine, 'use_cache': use_cache, 'wait': not kwargs['--no-wait'],
+                                 'stream': stream, 'priority': kwargs['--priority'],
+                                 'ttl': ttl}, sock_path)
+        if reply is not None:
+            if not reply['ok']:
+                logger.critical(reply['error'])
+            sys.exit(0 if reply['ok'] else 1)
+    if not _check_requirements():
+        logger.critical('_check_requirements() failed.')
+        sys.exit(-1)
+    if engine is None:
+        engine = default_engine()
+    elif not engine in available_engines():
+        logger.info("requested --engine='{}' not available. using engine '{}' instead".format(engine,default_engine()))
+        engine=default_engine()
+    if stream:
+        metrics = say_stream(msg,engine,use_cache=use_cache)
+        logger.info("time-to-first-audio {:.3f}s, max gap {:.3f}s, {} segments in {:.3f}s".format(
+            metrics['time_to_first_audio'], max(metrics['gaps'] or [0]), metrics['segments'], metrics['total']))
+    else:
+        say(msg,engine,use_cache=use_cache)
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+benchmark suite for the synthesis/playback pipeline of `say`.
+
+runs headless: audio goes to a null sink and the google engine talks to a
+local stand-in of the gTTS endpoint (unless --real-google), so neither audio
+hardware nor network is needed. the `dummy` engine measures the overhead of
+say itself. results can be saved as json and compared with an earlier run.
+
+Usage:
+say_bench.py [--engines=<list>] [--runs=<n>] [--stream-runs=<n>] [--output=<json>]
+             [--compare=<json>] [--threshold=<pct>] [--gtts-latency=<s>] [--real-google]
+
+Options:
+    --engines=<list>    Comma separated engines (default: all available)
+    --runs=<n>          Repetitions per measurement [default: 20]
+    --stream-runs=<n>   Repetitions of the (real-time) streaming measurement [default: 1]
+    --output=<json>     Save the results into this file
+    --compare=<json>    Compare with earlier results, exit 1 on a regression
+    --threshold=<pct>   Change (in percent) that counts as regression [default: 20]
+    --gtts-latency=<s>  Round-trip time the gTTS stand-in simulates [default: 0.05]
+    --real-google       Talk to the real gTTS endpoint instead of the stand-in
+    -h, --help          Print this
+
+Examples:
+    $ ./say_bench.py --output bench-0.1.25.json
+    $ ./say_bench.py --engines dummy,espeak --compare bench-0.1.25.json
+"""
+import asyncio
+import base64
+import io
+import json
+import os
+import platform
+import shutil
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from docopt import docopt
+
+SHORT_TEXT = "Backup finished."
+LONG_TEXT = ("The nightly backup has finished. All eleven volumes were copied without errors. "
+             "The archive server reports eighty percent free space, which is enough for two more weeks. "
+             "Next run is scheduled for tomorrow at two o'clock. Have a nice day!")
+
+
+class GTTSStandIn:
+    """
+    a local stand-in of the gTTS endpoint (translate.google.*/batchexecute).
+    answers every request after `latency` seconds with silence of a length
+    proportional to the text, wrapped the way google wraps the audio. the
+    first `fail` requests get a 503 instead. point say at it with
+    SAY_GTTS_URL=<url>.
+    """
+    def __init__(self, latency=0.05, host='127.0.0.1', port=0, fail=0):
+        self.latency = latency
+        self.fail = fail
+        self.requests = 0
+        self.connections = 0
+        stand_in = self
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1' # keep-alive
+            def setup(self):
+                BaseHTTPRequestHandler.setup(self)
+                # headers and body go out in separate writes, without this a kept-alive
+                # connection stalls on nagle + delayed ack like no real server would
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                stand_in.connections += 1
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+                rpc = json.loads(urllib.parse.parse_qs(body)['f.req'][0])
+                text = json.loads(rpc[0][0][1])[0]
+                stand_in.requests += 1
+                time.sleep(stand_in.latency)
+                if stand_in.requests <= stand_in.fail:
+                    self.send_response(503)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                audio = base64.b64encode(_silence(len(text) * 0.06)).decode('ascii')
+                line = json.dumps([["wrb.fr", "jQ1olc", json.dumps([audio]), None, None, None, "generic"]], separators=(",", ":"))
+                payload = (")]}'\n\n" + str(len(line)) + "\n" + line + "\n").encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+            def log_message(self, *args):
+                pass
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://{}:{}/_/TranslateWebserverUi/data/batchexecute'.format(host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _silence(seconds, rate=24000):
+    buf = io.BytesIO()
+    with wave.open(buf, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(b'\0\0' * int(rate * seconds))
+    return buf.getvalue()
+
+
+def _stats(timings, unit='s', better='lower'):
+    timings = sorted(timings)
+    return {'unit': unit, 'better': better, 'n': len(timings), 'min': timings[0],
+            'median': statistics.median(timings), 'mean': statistics.mean(timings),
+            'p95': timings[min(len(timings) - 1, int(len(timings) * 0.95))]}
+
+
+def _rate(value):
+    return {'unit': '1/s', 'better': 'higher', 'n': 1, 'median': value}
+
+
+def _timed(func, runs):
+    timings = []
+    for i in range(runs):
+        s = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - s)
+    return timings
+
+
+def bench_import(runs):
+    """wall time of `import say` in fresh interpreters, cold and warm capability cache (see startup_bench.py)."""
+    from startup_bench import bench
+    code = 'import say; say.available_engines()'
+    return {'import.cold': _stats(bench(code, runs, cold=True)), 'import.warm': _stats(bench(code, runs))}
+
+
+def bench_engine(say, engine, runs, stream_runs=1):
+    """per-call latency, time-to-first-audio and utterances per second for engine."""
+    results = {}
+    say.set_sink(say.NullSink())
+    results[engine + '.say.nocache'] = _stats(_timed(lambda: say.say(SHORT_TEXT, engine, use_cache=False), runs))
+    say.say(SHORT_TEXT, engine) # fill the cache
+    results[engine + '.say.cached'] = _stats(_timed(lambda: say.say(SHORT_TEXT, engine), runs))
+    # the null sink returns at once, so a call takes as long as say() needs until playback starts
+    results[engine + '.say.long.ttfa'] = _stats(_timed(lambda: say.say(LONG_TEXT, engine, use_cache=False), stream_runs))
+    total = sum(_timed(lambda: say.say(SHORT_TEXT, engine, use_cache=False), runs))
+    results[engine + '.throughput'] = _rate(runs / total)
+    async def concurrent():
+        await asyncio.gather(*[say.asay(SHORT_TEXT, engine, use_cache=False) for i in range(runs)])
+    s = time.perf_counter()
+    asyncio.run(concurrent())
+    results[engine + '.asay.throughput'] = _rate(runs / (time.perf_counter() - s))
+    # streaming needs a sink which takes as long as the audio, otherwise there are no gaps to measure
+    say.set_sink(say.NullSink(realtime=True))
+    ttfa, gaps = [], []
+    for i in range(stream_runs):
+        metrics = say.say_stream(LONG_TEXT, engine, use_cache=False)
+        ttfa.append(metrics['time_to_first_audio'])
+        gaps.append(max(metrics['gaps'] or [0.0]))
+    results[engine + '.stream.ttfa'] = _stats(ttfa)
+    results[engine + '.stream.max_gap'] = _stats(gaps)
+    say.set_sink(say.NullSink())
+    return results
+
+
+def compare(results, baseline, threshold):
+    """prints the changes against baseline. returns the names of regressed measurements."""
+    regressions = []
+    for name, r in sorted(results.items()):
+        if name not in baseline:
+            continue
+        old, new = baseline[name]['median'], r['median']
+        change = (new - old) / old * 100 if old else 0.0
+        worse = change > threshold if r['better'] == 'lower' else change < -threshold
+        if worse:
+            regressions.append(name)
+        print("{:<32} {:>12.4f} -> {:>12.4f} {:<4} {:+7.1f}% {}".format(
+            name, old, new, r['unit'], change, 'REGRESSION' if worse else ''))
+    return regressions
+
+
+def main():
+    kwargs = docopt(__doc__)
+    runs = int(kwargs['--runs'])
+    cache_dir = tempfile.mkdtemp(prefix='say-bench-')
+    os.environ['SAY_CACHE_DIR'] = cache_dir
+    os.environ['SAY_DUMMY_ENGINE'] = '1'
+    os.environ['SAY_AUDIO_SINK'] = 'null'
+    stand_in = None
+    if not kwargs['--real-google']:
+        stand_in = GTTSStandIn(float(kwargs['--gtts-latency'])).start()
+        os.environ['SAY_GTTS_URL'] = stand_in.url
+    try:
+        import say
+        say.logger.setLevel('WARNING')
+        engines = kwargs['--engines'].split(',') if kwargs['--engines'] else say.available_engines()
+        results = bench_import(runs)
+        say.start_workers([e for e in engines if e in say.available_engines()]) # no-op with SAY_ENGINE_WORKERS=0
+        for engine in engines:
+            if engine not in say.available_engines():
+                print("engine '{}' not available. skipped.".format(engine), file=sys.stderr)
+                continue
+            results.update(bench_engine(say, engine, runs, int(kwargs['--stream-runs'])))
+    finally:
+        if stand_in:
+            stand_in.stop()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    for name, r in sorted(results.items()):
+        if r['unit'] == 's':
+            print("{:<32} median {:9.2f} ms  p95 {:9.2f} ms".format(name, r['median'] * 1000, r['p95'] * 1000))
+        else:
+            print("{:<32} {:9.1f} {}".format(name, r['median'], r['unit']))
+    if kwargs['--output']:
+        meta = {'version': '.'.join(str(v) for v in say.__version__), 'python': platform.python_version(),
+                'platform': platform.platform(), 'machine': platform.machine(), 'time': time.time(),
+                'runs': runs, 'gtts_stand_in': stand_in is not None}
+        with open(kwargs['--output'], 'w') as fh:
+            json.dump({'meta': meta, 'results': results}, fh, indent=2)
+    if kwargs['--compare']:
+        with open(kwargs['--compare']) as fh:
+            baseline = json.load(fh)['results']
+        if compare(results, baseline, float(kwargs['--threshold'])):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
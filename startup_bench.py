@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+measures the startup time of `import say` (plus a first engine lookup) in
+fresh interpreters. optionally compares it against say.py of another git
+revision, e.g. one from before the lazy engine discovery. say_bench.py
+uses bench() for its import measurements.
+
+Usage:
+startup_bench.py [--runs=<n>] [--baseline=<git-rev>]
+
+Options:
+    --runs=<n>            Interpreter starts per scenario [default: 20]
+    --baseline=<git-rev>  Also measure say.py as of this git revision
+    -h, --help            Print this
+
+Examples:
+    $ ./startup_bench.py
+    $ ./startup_bench.py --runs 50 --baseline 4b0664e
+"""
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from docopt import docopt
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _time_run(code, cwd, env):
+    s = time.perf_counter()
+    subprocess.run([sys.executable, '-c', code], cwd=cwd, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - s
+
+
+def bench(code, runs, cwd=HERE, cold=False):
+    """
+    returns the wall times of `runs` interpreters executing code.
+    with cold=True every run gets an empty SAY_CACHE_DIR, so the capability
+    probe can't be answered from the cache.
+    """
+    timings = []
+    cache_dir = tempfile.mkdtemp(prefix='say-bench-')
+    try:
+        env = dict(os.environ, SAY_CACHE_DIR=cache_dir)
+        if not cold: # warm up the capability cache once
+            _time_run(code, cwd, env)
+        for i in range(runs):
+            if cold:
+                shutil.rmtree(cache_dir)
+                os.makedirs(cache_dir)
+            timings.append(_time_run(code, cwd, env))
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return timings
+
+
+def _report(name, timings):
+    ms = [t * 1000 for t in timings]
+    print("{:<50} min {:7.1f} ms  median {:7.1f} ms  mean {:7.1f} ms".format(
+        name, min(ms), statistics.median(ms), statistics.mean(ms)))
+
+
+def main():
+    kwargs = docopt(__doc__)
+    runs = int(kwargs['--runs'])
+    rev = kwargs['--baseline']
+    _report('python (reference, no import)', bench('pass', runs))
+    _report('import say (cold capabilities)', bench('import say', runs, cold=True))
+    _report('import say (warm capabilities)', bench('import say', runs))
+    _report('import say; available_engines() (cold)', bench('import say; say.available_engines()', runs, cold=True))
+    _report('import say; available_engines() (warm)', bench('import say; say.available_engines()', runs))
+    if rev:
+        baseline_dir = tempfile.mkdtemp(prefix='say-baseline-')
+        try:
+            src = subprocess.run(['git', 'show', '{}:say.py'.format(rev)], cwd=HERE,
+                                 check=True, stdout=subprocess.PIPE).stdout
+            with open(os.path.join(baseline_dir, 'say.py'), 'wb') as fh:
+                fh.write(src)
+            _report('import say @{}'.format(rev), bench('import say', runs, cwd=baseline_dir))
+            _report('import say; available_engines() @{}'.format(rev),
+                    bench('import say; say.available_engines()', runs, cwd=baseline_dir))
+        finally:
+            shutil.rmtree(baseline_dir)
+
+
+if __name__ == '__main__':
+    main()
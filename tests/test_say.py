@@ -0,0 +1,401 @@
+"""
+regression tests of say. run headless: python -m pytest tests
+"""
+import asyncio
+import json
+import os
+import socket
+import sys
+import threading
+import tempfile
+import time
+
+import pytest
+
+os.environ['SAY_DUMMY_ENGINE'] = '1' # silent engine, no binaries or network needed
+os.environ['SAY_AUDIO_SINK'] = 'null'
+os.environ['SAY_CACHE_DIR'] = tempfile.mkdtemp(prefix='say-test-')
+os.environ.pop('SAY_WORKERS', None)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import say
+
+
+@pytest.fixture
+def sink(monkeypatch):
+    """the NullSink all clips of the test go to."""
+    sink = say.NullSink()
+    monkeypatch.setattr(say, '_sink', sink)
+    return sink
+
+
+@pytest.fixture
+def cache(monkeypatch, tmp_path):
+    """an empty AudioCache used by say()."""
+    cache = say.AudioCache(str(tmp_path / 'cache'), 1 << 20)
+    monkeypatch.setattr(say, '_cache', cache)
+    return cache
+
+
+def test_asay_cancelled_before_start_releases_its_turn():
+    async def main():
+        try:
+            await say.asay("a", "dummy", timeout=0) # cancelled before run() started
+        except asyncio.TimeoutError:
+            pass
+        return await asyncio.wait_for(say.asay("c", "dummy"), 3)
+    assert asyncio.run(main()) is True
+
+
+def test_preempting_an_utterance_still_synthesizing(monkeypatch):
+    synthesize = say._synthesize
+    def slow_synthesize(msg, engine, use_cache=True):
+        if msg == "low":
+            time.sleep(0.5)
+        return synthesize(msg, engine, use_cache)
+    monkeypatch.setattr(say, '_synthesize', slow_synthesize)
+    daemon = say.SayDaemon(os.path.join(tempfile.mkdtemp(), 'say.sock'))
+    threading.Thread(target=daemon._speaker, daemon=True).start()
+    low = daemon.submit("low", 'dummy', priority='low')
+    time.sleep(0.2) # low is synthesizing now
+    urgent = daemon.submit("urgent", 'dummy', priority='urgent')
+    assert urgent.done.wait(3)
+    assert not low.done.is_set() # urgent went first
+    assert low.done.wait(3)
+    assert urgent.error is None
+    assert low.error is None # requeued, not stopped
+
+
+def test_read_manifest_reports_bad_lines_per_item(tmp_path):
+    manifest = tmp_path / 'manifest.jsonl'
+    manifest.write_text('hello\n{"text": "x", "output": "/etc/x"}\n{"text": "y", "output": "a/../../y"}\n{bad\n'
+                        '{"text": 5}\n{"text": " "}\n{"text": "e", "engine": ["dummy"]}\n{"text": "z", "output": "sub/z"}\n')
+    items = say.read_manifest(str(manifest), 'dummy')
+    assert [bool(item.get('error')) for item in items] == [False, True, True, True, True, True, True, False]
+    assert items[-1]['output'] == os.path.join('sub', 'z.wav')
+
+
+def test_cache_hit_writes_nothing(tmp_path):
+    cache = say.AudioCache(str(tmp_path), 1 << 20)
+    assert cache.get('a', '.wav') is None
+    cache.put('a', '.wav', b'RIFF') # writes the miss
+    stats_file = tmp_path / cache._STATS_FILE
+    mtime = stats_file.stat().st_mtime_ns
+    assert cache.get('a', '.wav') and cache.get('b', '.wav') is None
+    assert stats_file.stat().st_mtime_ns == mtime
+    assert (cache.stats()['hits'], cache.stats()['misses']) == (1, 2)
+    cache.flush()
+    assert json.loads(stats_file.read_text()) == {'hits': 1, 'misses': 2, 'evictions': 0}
+
+
+def test_capabilities_probed_once_by_concurrent_callers(monkeypatch, tmp_path):
+    probes = []
+    def slow_probe():
+        probes.append(1)
+        time.sleep(0.2)
+        return {'binaries': {}, 'modules': {}, 'libraries': {}}
+    monkeypatch.setattr(say, '_probe', slow_probe)
+    monkeypatch.setattr(say, '_capabilities', None)
+    monkeypatch.setattr(say, 'CAPABILITIES_FILE', str(tmp_path / 'capabilities.json'))
+    threads = [threading.Thread(target=say._get_capabilities) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(probes) == 1
+
+
+def test_default_engine_prefers_offline_engines(monkeypatch):
+    for engines, expected in ((['espeak', 'espeak-lib', 'google'], 'espeak-lib'), (['espeak', 'google'], 'espeak'),
+                              (['google', 'dummy'], 'dummy'), (['google'], 'google')):
+        monkeypatch.setattr(say, 'available_engines', lambda: engines)
+        assert say.default_engine() == expected
+    monkeypatch.setattr(say, 'available_engines', lambda: [])
+    with pytest.raises(Exception, match='no tts-engine'):
+        say.default_engine()
+
+
+def test_render_manifest_reports_every_failure(tmp_path):
+    manifest = tmp_path / 'manifest.jsonl'
+    manifest.write_text('{"text": "ok", "output": "ok"}\n{"text": 5}\n{"text": "x", "engine": "no-such-engine"}\n')
+    report = say.render_manifest(str(manifest), str(tmp_path / 'out'), 'dummy', jobs=1)
+    assert (report['rendered'], report['failed']) == (1, 2)
+    assert len([item for item in report['items'] if item['error']]) == 2
+    assert os.path.exists(tmp_path / 'out' / 'ok.wav')
+    report = say.render_manifest(str(manifest), str(tmp_path / 'out'), 'dummy', jobs=1) # resumed
+    assert (report['rendered'], report['skipped']) == (0, 1)
+
+
+def test_daemon_rejects_bad_requests(tmp_path):
+    daemon = say.SayDaemon(str(tmp_path / 'say.sock'))
+    server = say.JsonLineServer(daemon.sock_path, daemon._handle, 'say-daemon').listen()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        for req in ({'msg': 'x', 'ttl': 'abc'}, {'msg': 'x', 'ttl': -1}, {'msg': 'x', 'priority': 'asap'},
+                    {'msg': 'x', 'priority': ['urgent']}, {'msg': 5}, {'text': 'x'}):
+            reply = say.json_line_request(req, daemon.sock_path)
+            assert reply['ok'] is False and reply['error'].startswith('bad request'), req
+        with socket.socket(socket.AF_UNIX) as s, s.makefile('rwb') as fh:
+            s.connect(daemon.sock_path)
+            fh.write(b'["x"]\n')
+            fh.flush()
+            assert json.loads(fh.readline())['ok'] is False
+    finally:
+        server.close()
+
+
+def test_cache_ignores_dot_files(tmp_path):
+    (tmp_path / '.xask-fonts.json').write_text('{}')
+    (tmp_path / '.xask-fonts.json.123').write_text('{}')
+    cache = say.AudioCache(str(tmp_path), 1 << 20)
+    assert cache.stats()['entries'] == 0
+    cache.clear()
+    assert (tmp_path / '.xask-fonts.json').exists()
+
+
+def test_gtts_fetch_falls_back_to_the_public_api():
+    class NewGTTS: # a gTTS release without the private helpers
+        def write_to_fp(self, fp):
+            fp.write(b'mp3')
+    assert say._gtts_fetch(NewGTTS()) == b'mp3'
+
+
+def test_pygame_sink_plays_more_clips_than_mixer_channels(monkeypatch):
+    monkeypatch.setenv('SDL_AUDIODRIVER', 'dummy')
+    if not say._get_pygame():
+        pytest.skip("pygame not installed")
+    sink = say.PygameSink()
+    try:
+        sink.open()
+        wav = say._dummy_wav("a message which plays for a while")
+        playbacks = [sink.play(wav) for i in range(sink.pygame.mixer.get_num_channels() + 2)]
+        assert all(playback.done() is False for playback in playbacks)
+    finally:
+        sink.close()
+
+
+def test_stop_playback_interrupts_asay(monkeypatch):
+    monkeypatch.setattr(say, '_sink', say.NullSink(realtime=True))
+    async def main():
+        speaking = asyncio.ensure_future(say.asay("a message which plays for a while", "dummy"))
+        await asyncio.sleep(0.3)
+        assert say.stop_playback() == 1
+        with pytest.raises(say.Interrupted):
+            await asyncio.wait_for(speaking, 1)
+    asyncio.run(main())
+
+
+def test_cache_hit_returns_the_audio_itself(tmp_path):
+    cache = say.AudioCache(str(tmp_path), 1 << 20)
+    cache.put('a', '.wav', b'RIFF')
+    audio = cache.get('a', '.wav')
+    assert audio == b'RIFF' and isinstance(audio, say.CachedAudio)
+    os.remove(tmp_path / 'a.wav') # evicted by another process
+    assert cache.get('a', '.wav') is None
+    assert cache.stats()['misses'] == 1
+
+
+def test_say_fills_and_replays_the_cache(sink, cache):
+    assert say.say("hello cache", "dummy")
+    assert say.say("hello   cache", "dummy") # same text after whitespace normalization
+    assert say.say("hello cache", "dummy", use_cache=False)
+    assert sink.clips == 3
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (1, 1, 1)
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = say.AudioCache(str(tmp_path), 25)
+    cache.put('a', '.wav', b'a' * 10)
+    cache.put('b', '.wav', b'b' * 10)
+    os.utime(tmp_path / 'a.wav', (1, 1)) # a and b used long ago, a before b
+    os.utime(tmp_path / 'b.wav', (2, 2))
+    assert cache.get('a', '.wav') # a is the most recently used now
+    cache.put('c', '.wav', b'c' * 10)
+    assert sorted(os.listdir(tmp_path)) == ['.lock', '.stats.json', 'a.wav', 'c.wav']
+    assert cache.stats()['evictions'] == 1
+    cache.put('d', '.wav', b'd' * 30) # bigger than the budget: only the new entry stays
+    assert cache.get('d', '.wav') and cache.get('a', '.wav') is None and cache.get('c', '.wav') is None
+
+
+@pytest.fixture
+def daemon(tmp_path, sink, cache):
+    """a say-daemon listening on a socket of its own."""
+    daemon = say.SayDaemon(str(tmp_path / 'say.sock'))
+    thread = threading.Thread(target=daemon.serve_forever, daemon=True)
+    thread.start()
+    for i in range(100):
+        if daemon._server and os.path.exists(daemon.sock_path):
+            break
+        time.sleep(0.05)
+    yield daemon
+    daemon._server.close()
+    thread.join(3)
+
+
+def test_daemon_speaks_requests_of_clients(daemon, sink):
+    assert say.speak("via the daemon", "dummy", sock_path=daemon.sock_path)
+    assert sink.clips == 1
+    reply = say.json_line_request({'msg': "don't wait", 'engine': 'dummy', 'wait': False}, daemon.sock_path)
+    assert reply['ok'] and 'queued' in reply
+    for i in range(100): # spoken in the background
+        if sink.clips == 2:
+            break
+        time.sleep(0.05)
+    assert sink.clips == 2
+    with pytest.raises(Exception, match='already listening'):
+        say.SayDaemon(daemon.sock_path).serve_forever()
+
+
+def test_speak_without_daemon_speaks_in_process(tmp_path, sink, cache):
+    assert say.speak("no daemon around", "dummy", sock_path=str(tmp_path / 'nobody.sock'))
+    assert sink.clips == 1
+
+
+def test_split_sentences():
+    assert say._split_sentences("One. Two! Three?  Four") == ["One.", "Two!", "Three?", "Four"]
+    long = "a clause, " * 30
+    assert all(len(segment) <= 40 for segment in say._split_sentences(long, max_len=40))
+    assert ' '.join(say._split_sentences(long, max_len=40)) == long.strip()
+
+
+def test_say_stream_plays_sentence_by_sentence(sink, cache):
+    metrics = say.say_stream("The first sentence. The second one! And a third?", "dummy")
+    assert metrics['segments'] == 3 and sink.clips == 3
+    assert 0 <= metrics['time_to_first_audio'] <= metrics['total']
+
+
+def test_follow_speaks_every_line(sink, cache):
+    import io
+    stats = say.follow(io.StringIO("first line\n\n  second line  \nthird line\n"), "dummy")
+    assert (stats['read'], stats['spoken'], stats['dropped'], stats['coalesced']) == (3, 3, 0, 0)
+    assert sink.clips == 3
+
+
+def test_follow_buffer_backpressure_policies():
+    buf = say._FollowBuffer(2, 'drop-oldest')
+    for line in ("a", "b", "c"):
+        buf.put(line)
+    buf.close()
+    assert (buf.get(), buf.get(), buf.get(), buf.dropped) == ("b", "c", None, 1)
+    buf = say._FollowBuffer(2, 'coalesce')
+    for line in ("a", "b", "c"):
+        buf.put(line)
+    assert buf.get() == say.COALESCE_TEMPLATE.format(n=3, last="c") and buf.coalesced == 3
+    buf = say._FollowBuffer(1, 'block')
+    buf.put("a")
+    writer = threading.Thread(target=buf.put, args=("b",))
+    writer.start()
+    writer.join(0.2)
+    assert writer.is_alive() # blocked until there's room again
+    assert buf.get() == "a"
+    writer.join(1)
+    assert buf.get() == "b"
+
+
+def test_render_manifest_writes_one_file_per_prompt(tmp_path):
+    import wave
+    manifest = tmp_path / 'prompts.txt'
+    manifest.write_text("Hello world.\nGood bye!\n")
+    report = say.render_manifest(str(manifest), str(tmp_path / 'out'), 'dummy', jobs=2)
+    assert (report['rendered'], report['failed']) == (2, 0)
+    assert sorted(os.listdir(tmp_path / 'out')) == ['00001-hello-world.wav', '00002-good-bye.wav']
+    with wave.open(str(tmp_path / 'out' / '00002-good-bye.wav')) as w:
+        assert w.getnframes() > 0
+
+
+def test_sink_selected_by_audio_sink(monkeypatch, tmp_path, cache):
+    monkeypatch.setattr(say, '_sink', None)
+    monkeypatch.setattr(say, 'AUDIO_SINK', 'file:' + str(tmp_path / 'clips'))
+    sink = say.get_sink()
+    assert isinstance(sink, say.FileSink) and say.get_sink() is sink # kept open for the process
+    assert say.say("one", "dummy") and say.say("two", "dummy")
+    assert sorted(os.listdir(tmp_path / 'clips')) == ['00001.wav', '00002.wav']
+    monkeypatch.setattr(say, '_sink', None)
+    monkeypatch.setattr(say, 'AUDIO_SINK', 'no-such-sink')
+    with pytest.raises(Exception, match='unknown AUDIO_SINK'):
+        say.get_sink()
+
+
+def test_null_sink_realtime_plays_as_long_as_the_clip():
+    sink = say.NullSink(realtime=True)
+    wav = say._dummy_wav("x" * 10)
+    duration = say._audio_duration(wav)
+    t_start = time.monotonic()
+    assert sink.play(wav).wait()
+    assert time.monotonic() - t_start >= duration * 0.9
+    playback = sink.play(wav)
+    playback.stop()
+    assert playback.done()
+
+
+def test_say_many_plays_the_segments_as_one_clip(sink, cache):
+    segments = [("Look Dave,", "dummy"), ("I can see you're really upset about this.", "dummy")]
+    report = say.say_many(segments)
+    assert report['segments'] == 2 and sink.clips == 1
+    expected = sum(len(text) for text, engine in segments) * say.DUMMY_SECONDS_PER_CHAR
+    assert abs(report['duration'] - expected) < 0.01
+    assert say.say_many([]) == {'segments': 0, 'duration': 0.0, 'ready': 0.0, 'wall': 0.0}
+    with pytest.raises(Exception, match='not available'):
+        say.say_many([("x", "no-such-engine")])
+
+
+def test_speech_queue_priority_dedup_and_ttl():
+    q = say.SpeechQueue(dedup_window=30)
+    low = q.put(say._Utterance("disk almost full", priority='low'))
+    first = q.put(say._Utterance("build finished"))
+    second = q.put(say._Utterance("tests passed"))
+    stale = q.put(say._Utterance("coffee is ready", ttl=0))
+    twin = q.put(say._Utterance("disk almost full", priority='high'))
+    assert twin is low and low.merged == 1 and low.priority == say.PRIORITIES['high']
+    assert q.qsize() == 4 and q.counters['deduplicated'] == 1
+    time.sleep(0.01)
+    spoken = []
+    for _ in range(3):
+        u = q.get()
+        spoken.append(u.msg)
+        q.task_done(u)
+    assert spoken == ["disk almost full", "build finished", "tests passed"]
+    q.close()
+    assert q.get() is None # the stale one is dropped, not spoken
+    assert stale.done.is_set() and stale.error.startswith('expired') and q.counters['expired'] == 1
+    assert q.qsize() == 0
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def test_render_falls_back_to_local_synthesis_if_no_worker_is_up(monkeypatch):
+    dead = '127.0.0.1:{}'.format(_free_port())
+    monkeypatch.setattr(say, 'REMOTE_WORKERS', [dead])
+    monkeypatch.setattr(say, '_remote_workers', None)
+    audio = say._render_bytes("open the pod bay doors", 'dummy', use_cache=False)
+    assert audio[:4] == b'RIFF'
+    assert say.get_remote_workers().stats()[dead]['failures'] == 1
+    assert say.get_remote_workers().stats()[dead]['up'] is False
+
+
+def test_render_on_a_remote_worker(monkeypatch, tmp_path):
+    import subprocess
+    live = '127.0.0.1:{}'.format(_free_port())
+    env = dict(os.environ, SAY_CACHE_DIR=str(tmp_path))
+    worker = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(say.__file__), 'say.py'),
+                               '--worker', '--listen', live], env=env)
+    try:
+        for _ in range(500):
+            try:
+                socket.create_connection(say._parse_address(live), timeout=1).close()
+                break
+            except OSError:
+                time.sleep(0.01)
+        monkeypatch.setattr(say, 'REMOTE_WORKERS', [live])
+        monkeypatch.setattr(say, '_remote_workers', None)
+        audio = say._render_bytes("open the pod bay doors", 'dummy')
+        assert audio[:4] == b'RIFF'
+        assert say.get_remote_workers().stats()[live] == {'jobs': 1, 'failures': 0, 'up': True}
+    finally:
+        worker.terminate()
+        worker.wait(5)
@@ -7,15 +7,19 @@ returncode reflects answer in common unix-style (0 == yes/ok, 1 == nope)
 
 Usage:
 xask [<msg>] [--yes=<reply_yes>] [--no=<reply_no>] [--engine=<tts-engine>]
-     [--yes-exec=<yes-exec>] [--no-exec=<no-exec>]
+     [--yes-exec=<yes-exec>] [--no-exec=<no-exec>] [--socket=<path>] [--no-kiosk]
+xask --kiosk [--socket=<path>]
 
 Options:
-    --engine=<str>   TTS-engine to use {'google', 'espeak', 'festival'}
-                     [default: espeak]
+    --engine=<str>   TTS-engine to use {'google', 'espeak', 'espeak-lib', 'festival'}
+                     (default: espeak-lib, espeak or another offline engine)
     --no=<str>       Message for negative answer
     --no-exec=<str>  execute given command by negative answer
     --yes=<str>      Message for positive answer
     --yes-exec=<str> execute given command by positive answer
+    --kiosk          Keep the display open and ask the questions sent to the socket
+    --socket=<path>  Socket of the kiosk (default: $XDG_RUNTIME_DIR/xask-<uid>.sock)
+    --no-kiosk       Don't hand over to a running kiosk, open an own display
 
     -h, --help       Print this
     --version        Print version
@@ -24,13 +28,21 @@ Examples:
     $ xask "Do you want to play a game?" && echo "Splendid! :)"
     $ xask "Do you want to play a game?" --yes="Splendid, let's play!" --no="Okidoki. Maybe another time."
     $ xask "Reboot universe?" --yes="rebooting now." --yes-exec "init 6" --no="Ok. Maybe another time."
+    $ xask --kiosk &
+    $ xask "First question?" && xask "Second question?" # asked on the kiosk's display
 """
+import json
 import logging
 import os
+import queue
+import re
+import socket
 import subprocess
 import sys
+import tempfile
 import threading
 import time
+from collections import OrderedDict
 
 logger = logging.getLogger(__name__)
 #logger.setLevel(logging.INFO)
@@ -49,7 +61,7 @@ try:
 except ImportError:
     logger.critical("whuuups. no pygame import possible :/")
     sys.exit(1)
-from say import __version__, available_engines, ENGINE_DEFAULT, say
+from say import __version__, available_engines, default_engine, say, stop_playback, Interrupted, JsonLineServer, json_line_request, CACHE_DIR, metrics_gauge, prefetch, speak_reply, discard_prefetched, get_cache, start_workers
 
 _VERBOSITY = 0
 
@@ -61,6 +73,7 @@ MARGIN = [0,0,0,0] # top, left, right, bottom
 VT100 = (80,24) # https://de.wikipedia.org/wiki/VT100
 #PAGE_SIZE=VT100
 PAGE_SIZE=(20,6)
+KIOSK_SOCKET=os.environ.get('SAY_XASK_SOCKET', os.path.join(os.environ.get('XDG_RUNTIME_DIR', tempfile.gettempdir()), 'xask-{}.sock'.format(os.getuid())))
 
 # === THEME / COLOR SCHEME
 # --- day
@@ -109,41 +122,85 @@ def _init_screen(fullscreen=FULLSCREEN):
     return surface
 
 
+FONT_SIZE_MIN = 1
+FONT_SIZE_MAX = 100
+FONT_CACHE_PERSIST = True # remember fitting font sizes across runs
+FONT_CACHE_FILE = os.path.join(CACHE_DIR, '.xask-fonts.json') # a dot-file, so the AudioCache leaves it alone
+_font_cache = {} # (surface size, page size, font name, margin) -> font
+
+
+def _font_fits(font, font_size, page_size, width, height):
+    ref_char = ' '
+    #ref_size_x = font.get_rect(ref_char, size=font_size).width
+    ref_size_x = font.get_rect(ref_char, size=font_size).width + 1 # WORKAROUND: add one pixel per char to be safe ?
+    ref_size_y = font.get_sized_height(font_size) + 2
+    logger.debug("fontsize={} : ref_char's size_x={} size_y={}".format(font_size, ref_size_x,ref_size_y))
+    return (ref_size_x * page_size[0] <= width) and (ref_size_y * page_size[1] <= height)
+
+
+def _load_font_sizes():
+    try:
+        with open(FONT_CACHE_FILE) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_font_size(key, font_size):
+    sizes = _load_font_sizes()
+    sizes[key] = font_size
+    try:
+        os.makedirs(os.path.dirname(FONT_CACHE_FILE), exist_ok=True)
+        fn_tmp = FONT_CACHE_FILE + '.' + str(os.getpid())
+        with open(fn_tmp, 'w') as fh:
+            json.dump(sizes, fh)
+        os.replace(fn_tmp, FONT_CACHE_FILE)
+    except OSError as e:
+        logger.debug("could not write '{}': {}".format(FONT_CACHE_FILE, e))
+
+
 def get_font_for_page(surface=None, page_size = (80,24), font = "FreeMono, Monospace", margin=(0,0,0,0), monospace=True):
     """
     calculates the (monospace) fontsize for page_size (<columns_char_N>,<rows_char_N>)
 
+    the font is loaded once and the largest fitting size is found by bisection
+    (the size of a monospace char grows with the font size). results are cached
+    per (surface size, page size, font, margin) in memory and, if
+    FONT_CACHE_PERSIST is set, in FONT_CACHE_FILE.
+
     returns FontInstance
     """
     assert(isinstance(font,str))
     font_name = font
-    FONT_SIZE_MIN = 1
-    width, height = surface.get_size()
-    width -= MARGIN[1] + MARGIN[2]  # left + right
-    height -= MARGIN[0] + MARGIN[3] # top + bottom
-    font_size = 101
-    ref_char = ' '
     assert(FONT_SIZE_MIN > 0)
-    ref_size_x = None
-    ref_size_y = None
-    font = None
-    running = True
-    while running:
-        if font_size > (FONT_SIZE_MIN + 1):
-            font_size -= 1
-        else:
-            raise Exception("Ouch! Fontsize required for page_size={} < {} :-/".format(page_size,FONT_SIZE_MIN))
-        font = pygame.freetype.SysFont(font_name, font_size)
-        font.origin = True
-        #ref_size_x = font.get_rect(ref_char).width
-        ref_size_x = font.get_rect(ref_char).width + 1 # WORKAROUND: add one pixel per char to be safe ?
-        ref_size_y = font.get_sized_height() + 2
-        if (ref_size_x * page_size[0] > width) or (ref_size_y * page_size[1] > height):
-            logger.debug("fontsize={} : ref_char's size_x={} size_y={}".format(font_size, ref_size_x,ref_size_y))
-            continue
-        else: # got fitting fontsize
-            running = False
-            logger.info("found fontsize={} (font={}) suiting for page_size={} # ref_char's ('{}') size_x={} size_y={}".format(font_size, font_name, page_size, ref_char, ref_size_x,ref_size_y))
+    key = (surface.get_size(), tuple(page_size), font_name, tuple(margin))
+    if key in _font_cache:
+        return _font_cache[key]
+    t_start = time.perf_counter()
+    width, height = surface.get_size()
+    width -= margin[1] + margin[2]  # left + right
+    height -= margin[0] + margin[3] # top + bottom
+    font = pygame.freetype.SysFont(font_name, FONT_SIZE_MAX)
+    font.origin = True
+    persisted = _load_font_sizes() if FONT_CACHE_PERSIST else {}
+    font_size = persisted.get(repr(key))
+    if font_size is None or not _font_fits(font, font_size, page_size, width, height):
+        lo, hi = FONT_SIZE_MIN + 1, FONT_SIZE_MAX # search the largest fitting size in [lo, hi]
+        if not _font_fits(font, lo, page_size, width, height):
+            raise Exception("Ouch! Fontsize required for page_size={} < {} :-/".format(page_size,lo))
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if _font_fits(font, mid, page_size, width, height):
+                lo = mid
+            else:
+                hi = mid - 1
+        font_size = lo
+        if FONT_CACHE_PERSIST:
+            _save_font_size(repr(key), font_size)
+    font.size = font_size
+    _font_cache[key] = font
+    logger.info("found fontsize={} (font={}) suiting for page_size={} in {:.1f}ms".format(
+        font_size, font_name, page_size, (time.perf_counter() - t_start) * 1000))
     return font
 
 
@@ -247,28 +304,239 @@ def word_wrap(surf = None, text = None, stop_pos = None, font = None, color=(0,
     return x, y
 
 
+GLYPH_CACHE_SIZE = 2048 # max. nr. of pre-rendered glyphs kept
+
+
+class GlyphCache:
+    """
+    pre-rendered glyph surfaces keyed by (font, size, color, char), so FreeType
+    rasterizes each glyph once instead of on every draw. bounded (least
+    recently used glyphs are dropped first) and cleared when the font or its
+    size changes, e.g. after get_font_for_page() fitted a new size.
+    """
+    def __init__(self, maxsize=GLYPH_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.font = None # (name, size) of the cached glyphs
+        self.glyphs = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, font, char, color):
+        """
+        returns (surface, rect) like font.render(), rect is relative to the origin.
+        """
+        if self.font != (font.name, font.size):
+            self.glyphs.clear()
+            self.font = (font.name, font.size)
+        key = (font.name, font.size, tuple(color), char)
+        glyph = self.glyphs.get(key)
+        if glyph is not None:
+            self.glyphs.move_to_end(key)
+            self.hits += 1
+            return glyph
+        self.misses += 1
+        surface, rect = font.render(char, color)
+        if pygame.display.get_surface() is not None:
+            surface = surface.convert_alpha() # blits faster in display format
+        glyph = self.glyphs[key] = (surface, rect)
+        if len(self.glyphs) > self.maxsize:
+            self.glyphs.popitem(last=False)
+        return glyph
+
+    def blit(self, surf, font, char, color, pos):
+        """
+        draws char with its origin at pos. returns the changed rect.
+        """
+        surface, rect = self.get(font, char, color)
+        return surf.blit(surface, (pos[0] + rect.x, pos[1] - rect.y))
+
+
+_glyphs = GlyphCache()
+
+
+class PageLayout:
+    """
+    glyph positions of a page. computed once per page and extended when text is
+    appended (e.g. the reply of xask), so revealing the next char of a page
+    doesn't require to lay out the whole page again. wraps words like
+    word_wrap() does.
+    """
+    def __init__(self, surf, font, margin=None):
+        if margin is None:
+            margin = MARGIN
+        self.font = font
+        self.margin = margin
+        self.size = surf.get_size()
+        self.width = self.size[0] - (margin[1] + margin[2])  # left + right
+        self.height = self.size[1] - (margin[0] + margin[3]) # top + bottom
+        self.line_spacing = font.get_sized_height() + 2
+        self.space = font.get_rect(' ')
+        self.text = ''
+        self.glyphs = [] # (char, x, y) for each char of text, y is the baseline
+        self.x, self.y = margin[1], self.line_spacing + margin[0] # pen position
+
+    def extend(self, text):
+        for token in re.findall(r'\n|[^ \n]+ ?| ', text):
+            if token == '\n':
+                self.glyphs.append((token, self.x, self.y))
+                self.x, self.y = self.margin[1], self.y + self.line_spacing
+                continue
+            bounds = self.font.get_rect(token)
+            if self.x + bounds.width > self.width:
+                self.x, self.y = self.margin[1], self.y + self.line_spacing
+            if self.x + bounds.width > self.width:
+                raise ValueError("word {} px to wide (x) for the surface".format(self.width - (self.x + bounds.width)))
+            if self.y + bounds.height - bounds.y > self.height:
+                raise ValueError("text to long (y) for the surface")
+            x = self.x
+            for char, metrics in zip(token, self.font.get_metrics(token)):
+                self.glyphs.append((char, x, self.y))
+                x += metrics[4] if metrics else self.space.width # horizontal advance
+            self.x += bounds.width
+        self.text += text
+
+    def draw(self, surf, start, stop, color):
+        """
+        draws the glyphs of text[start:stop]. returns the list of changed rects.
+        """
+        rects = []
+        for char, x, y in self.glyphs[start:stop]:
+            if char not in ' \n':
+                rects.append(_glyphs.blit(surf, self.font, char, color, (round(x), y)))
+        return rects
+
+    def cursor(self, pos):
+        """
+        returns the rect of a cursor in front of text[pos]
+        """
+        x, y = self.glyphs[pos][1:] if pos < len(self.glyphs) else (self.x, self.y)
+        height = (self.line_spacing / 100) * 80
+        return Rect((round(x), y - height), (self.space.width, height)) # left, top, width, height
+
+
+_layout = None
+
+
+def _get_layout(surf, font, page):
+    """
+    returns the layout of page, extending the previous layout if page continues it.
+    """
+    global _layout
+    if (_layout is None or _layout.font is not font or _layout.size != surf.get_size()
+            or not page.startswith(_layout.text)):
+        _layout = PageLayout(surf, font)
+    if len(page) > len(_layout.text):
+        _layout.extend(page[len(_layout.text):])
+    return _layout
+
+
+TRANSITION_FPS = 30 # chars revealed per second
+BLINK_INTERVAL = 0.5 # the cursor toggles every BLINK_INTERVAL seconds
+render_stats = {} # of the last _show_message() call, see there
+FRAME_LOG = os.environ.get('SAY_XASK_FRAME_LOG') # append frame times of every page as json-lines
+
+
+INPUT_POLL_INTERVAL = 0.03 # see _wait_event()
+# video drivers with a native SDL_WaitEventTimeout(). for the others (e.g. kmsdrm,
+# dummy) SDL polls every millisecond, which is more expensive than polling ourselves.
+_NATIVE_WAIT_DRIVERS = ('x11', 'wayland', 'windows', 'cocoa')
+
+
+def _next_blink_edge(now):
+    return now - now % BLINK_INTERVAL + BLINK_INTERVAL
+
+
+def _wait_event(timeout=None):
+    """
+    sleeps until an event arrives or timeout (seconds, None == forever) passed.
+    returns the list of pending events.
+    """
+    if pygame.display.get_driver() in _NATIVE_WAIT_DRIVERS:
+        if timeout is None:
+            return [pygame.event.wait()] + pygame.event.get()
+        return [pygame.event.wait(max(1, int(timeout * 1000) + 1))] + pygame.event.get()
+    deadline = None if timeout is None else time.time() + timeout
+    while True:
+        events = pygame.event.get()
+        now = time.time()
+        if events or (deadline is not None and now >= deadline):
+            return events
+        time.sleep(INPUT_POLL_INTERVAL if deadline is None else min(INPUT_POLL_INTERVAL, deadline - now + 0.001))
+
+
+def _log_frames(surf, page):
+    record = {'time': time.time(), 'window': surf.get_size(), 'page_size': PAGE_SIZE, 'chars': len(page)}
+    record.update(render_stats)
+    record['frame_times'] = [round(t * 1000, 3) for t in record['frame_times']] # ms
+    try:
+        with open(FRAME_LOG, 'a') as fh:
+            fh.write(json.dumps(record) + "\n")
+    except OSError as e:
+        logger.warning("could not write frame log '{}': {}".format(FRAME_LOG, e))
+
+
 def _show_message(surf=None, page="Do you want to play a game?", page_from_pos=0, show_cursor=True, wait_for_keypress=True):
     """
     shows message (question) char by char (full-)screen
 
+    redraws only on state changes (next char revealed, cursor blink edge,
+    expose event) and sleeps in _wait_event() in between. the frame
+    rates and the cpu usage of the idle phase (page shown, waiting for a key)
+    are kept in render_stats and set as metrics gauges, as well as the time
+    needed to fit the font, the time to the first frame and the render time
+    of every frame (appended to FRAME_LOG if set).
+
     returns
 
-        key pressed by user # e.g "y", "n"
+        (key pressed by user, time.perf_counter() of the keypress) # e.g ("y", 1234.5), (None, None) without keypress
     """
     SHOW_CURSOR=show_cursor
+    t_enter = time.perf_counter()
     font = get_font_for_page(surface=surf, page_size = PAGE_SIZE, margin=MARGIN)
+    font_fit = time.perf_counter() - t_enter
+    layout = _get_layout(surf, font, page)
     # **
     page_in_transition = True
     page_transition_pos = page_from_pos
-    page_transition_state = ""
     # **
+    # the page is drawn once, afterwards only the newly revealed glyphs and
+    # the cursor are drawn and updated on the display (dirty rects).
+    surf.fill(BACKGROUND_COLOR)
+    shown = min(page_from_pos, len(page)) # nr. of chars drawn
+    layout.draw(surf, 0, shown, TEXT_COLOR)
+    pygame.display.update()
+    ttff = time.perf_counter() - t_enter
+    frame_times = [] # render time of each frame, waiting excluded
+    cursor = None # rect of the cursor currently drawn
+    under_cursor = None # content of the surface below the cursor
     running = True
     user_pressed_key = None
-    clock = pygame.time.Clock()
+    t_key = None
+    t_start = time.perf_counter()
+    frames = 0
+    idle_start = None # perf_counter, thread_time and frames when the idle phase began
+    next_char = time.time()
     while running:
-        for event in pygame.event.get():
+        # === sleep until the next state change
+        now = time.time()
+        wake_up = None
+        if page_in_transition:
+            wake_up = next_char
+        elif not wait_for_keypress:
+            running = False
+        elif idle_start is None:
+            idle_start = (time.perf_counter(), time.thread_time(), frames)
+        if SHOW_CURSOR and running:
+            wake_up = min(wake_up or float('inf'), _next_blink_edge(now))
+        if not running or (wake_up is not None and wake_up <= now):
+            events = pygame.event.get()
+        else:
+            events = _wait_event(None if wake_up is None else wake_up - now)
+        dirty = []
+        for event in events:
             # === event handler ===
             if event.type == KEYDOWN:
+                t_key = time.perf_counter()
                 if (event.key == K_ESCAPE):
                     events = pygame.event.get()
                     user_pressed_key = event
@@ -278,76 +546,115 @@ def _show_message(surf=None, page="Do you want to play a game?", page_from_pos=0
                     user_pressed_key = event.unicode
                     running = False
                     break;
+            elif event.type == VIDEOEXPOSE:
+                dirty.append(surf.get_rect())
+        if not running:
+            break
         # === show content
-        surf.fill(BACKGROUND_COLOR)
-        if page_in_transition:
-            page_transition_state = page[0:page_transition_pos + 1]
-            x,y = word_wrap(surf, page_transition_state, None, font, TEXT_COLOR)
+        t_frame = time.perf_counter()
+        now = time.time()
+        reveal = page_in_transition and now >= next_char
+        blink_on = SHOW_CURSOR and now % (2 * BLINK_INTERVAL) >= BLINK_INTERVAL
+        if cursor and (reveal or not blink_on):
+            surf.blit(under_cursor, cursor)
+            dirty.append(cursor)
+            cursor = None
+        if reveal:
+            stop = min(page_transition_pos + 1, len(page))
+            dirty += layout.draw(surf, shown, stop, TEXT_COLOR)
+            shown = stop
             if page_transition_pos == len(page): # transition finished
                 page_in_transition = False
-            #if time.time() % 1 > 0.2: # speed of transition progress
-            #    page_transition_pos += 1
             page_transition_pos += 1
-        else:
-            x,y = word_wrap(surf, page, None, font, TEXT_COLOR)
-            if not wait_for_keypress:
-                running = False
-        cursor_pos = page_transition_pos + 1
-        # === cursor positioning
-        font.origin = True
-        line_spacing = font.get_sized_height() + 2
-        space = font.get_rect(' ')
-        cursor_width = space.width
-        cursor_height_percentage = 100
-        cursor_height = (line_spacing / 100) * 80
-        if SHOW_CURSOR:
-            if page_in_transition:
-                x,y = word_wrap(surf=surf, text=page_transition_state, stop_pos=cursor_pos, font = font, color=TEXT_COLOR, render=False)
-            else:
-                x,y = word_wrap(surf=surf, text=page, stop_pos=cursor_pos, font = font, color=TEXT_COLOR, render=False)
-            if x > MARGIN[1]:
-                cursor = Rect((x, y - cursor_height), (cursor_width, cursor_height)) # left, top, width, height
-            else:
-                cursor = Rect((x,y - cursor_height), (cursor_width, cursor_height)) # left, top, width, height
-            if time.time() % 1 > 0.5: # blinking
-                pygame.draw.rect(surf, CURSOR_COLOR, cursor)
-                # --- TODO save a screenshot or gif-animation for docs
-                #if not page_in_transition:
-                #    pygame.image.save(surf,'/tmp/screenshot_xask.png') # save screenshot
-                # ---
-        clock.tick(30)
-        pygame.display.update()
-    return user_pressed_key
-
-
-def xsay(msg,engine,surf=None,quit_if_done=False,timeout=None):
+            next_char += 1 / TRANSITION_FPS
+        # === cursor
+        if blink_on and not cursor:
+            cursor = layout.cursor(shown).clip(surf.get_rect())
+            under_cursor = surf.subsurface(cursor).copy()
+            pygame.draw.rect(surf, CURSOR_COLOR, cursor)
+            dirty.append(cursor)
+            # --- TODO save a screenshot or gif-animation for docs
+            #if not page_in_transition:
+            #    pygame.image.save(surf,'/tmp/screenshot_xask.png') # save screenshot
+            # ---
+        if dirty:
+            pygame.display.update(dirty)
+            frames += 1
+            frame_times.append(time.perf_counter() - t_frame)
+    elapsed = time.perf_counter() - t_start
+    render_stats.clear()
+    render_stats.update({'frames': frames, 'fps': frames / elapsed if elapsed else 0.0,
+                         'idle_seconds': 0.0, 'idle_fps': 0.0, 'idle_cpu': 0.0,
+                         'font_fit': font_fit, 'ttff': ttff, 'frame_times': frame_times})
+    if idle_start:
+        idle = time.perf_counter() - idle_start[0]
+        if idle > 0:
+            render_stats.update({'idle_seconds': idle, 'idle_fps': (frames - idle_start[2]) / idle,
+                                 'idle_cpu': (time.thread_time() - idle_start[1]) / idle})
+    logger.info("_show_message: frames={frames} fps={fps:.1f} ttff={ttff:.4f}s font_fit={font_fit:.4f}s idle_cpu={idle_cpu:.3f}".format(**render_stats))
+    for k in ('fps', 'idle_fps', 'idle_cpu'):
+        metrics_gauge('say_xask_' + k, render_stats[k])
+    metrics_gauge('say_xask_ttff_seconds', ttff)
+    metrics_gauge('say_xask_font_fit_seconds', font_fit)
+    if FRAME_LOG:
+        _log_frames(surf, page)
+    return user_pressed_key, t_key
+
+
+def _say_until(msg, engine, cancel):
+    try:
+        say(msg, engine, cancel=cancel)
+    except Interrupted: # the user answered before msg was spoken completely
+        pass
+
+
+def _xsay(msg,engine,surf=None,quit_if_done=False):
     """
-    **experimental** a graphical retro-style version of `say`.
+    xsay() which returns (key, time.perf_counter() of the keypress). the rest
+    of msg isn't spoken once a key is pressed.
     """
     if not surf:
         surf = _init_screen(fullscreen=FULLSCREEN)
+    cancel = threading.Event()
     t1 = ThreadWithReturnValue(target=_show_message,args=(surf,msg,))
-    t2 = threading.Thread(target=say,args=(msg,engine))
+    t2 = threading.Thread(target=_say_until,args=(msg,engine,cancel))
     t1.start()
     #time.sleep(0.5)
     t2.start()
-    res = t1.join()
+    key, t_key = t1.join()
+    if t_key is not None and t2.is_alive():
+        cancel.set() # not played yet
+        stop_playback() # or playing right now
     t2.join()
     if quit_if_done:
         pygame.quit()
-    return res
+    return key, t_key
+
+
+def xsay(msg,engine,surf=None,quit_if_done=False,timeout=None):
+    """
+    **experimental** a graphical retro-style version of `say`.
+    """
+    return _xsay(msg,engine,surf,quit_if_done)[0]
 
 
 def xask(msg,r_yes,r_no,engine,surf=None,quit_if_done=False):
-    key_pressed = xsay(msg,engine,surf,quit_if_done)
+    for reply in (r_yes, r_no): # synthesized while the question is shown
+        if reply:
+            prefetch(reply,engine)
+    key_pressed, t_answer = _xsay(msg,engine,surf,quit_if_done)
+    if t_answer is None:
+        t_answer = time.perf_counter()
     is_yes = False
     if key_pressed in ['y','Y','j','J']: is_yes = True
+    if not isinstance(key_pressed, str): # escape
+        key_pressed = ''
     if is_yes:
         page_from_pos = len(msg)
         if r_yes:
             msg += key_pressed + "\n" + r_yes
             t1 = ThreadWithReturnValue(target=_show_message,args=(surf,msg,page_from_pos,True,False))
-            t2 = threading.Thread(target=say,args=(r_yes,engine,))
+            t2 = threading.Thread(target=speak_reply,args=(r_yes,engine,t_answer))
             t1.start()
             t2.start()
             res = t1.join()
@@ -357,17 +664,131 @@ def xask(msg,r_yes,r_no,engine,surf=None,quit_if_done=False):
         if r_no:
             msg += key_pressed + "\n" + r_no[:-1] + "."
             t1 = ThreadWithReturnValue(target=_show_message,args=(surf,msg,page_from_pos,True,False))
-            t2 = threading.Thread(target=say,args=(r_no,engine,))
+            t2 = threading.Thread(target=speak_reply,args=(r_no,engine,t_answer))
             t1.start()
             t2.start()
             res = t1.join()
             t2.join()
+    discard_prefetched()
     return is_yes
 
 
+# --- kiosk
+# `xask --kiosk` keeps the display (fullscreen, fitted fonts, glyphs) and the
+# tts engines open and asks the questions which xask clients send to its
+# unix socket, one after another. a request is a json line {'msg', 'yes',
+# 'no', 'engine'}, the reply {'ok', 'yes', 'rc'} is sent once the question is
+# answered. the clients run --yes-exec/--no-exec themselves.
+
+class _Question:
+    def __init__(self, req, conn):
+        self.req = req
+        self.conn = conn
+        self.reply = None
+        self.done = threading.Event()
+
+    def abandoned(self):
+        """true if the client hung up while the question was queued"""
+        try:
+            return self.conn.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b''
+        except BlockingIOError:
+            return False
+        except OSError:
+            return True
+
+
+class XaskKiosk:
+    def __init__(self, sock_path=KIOSK_SOCKET, fullscreen=FULLSCREEN):
+        self.sock_path = sock_path
+        self.fullscreen = fullscreen
+        self.questions = queue.Queue()
+        self.asked = 0
+        self._server = None
+
+    def _warm_up(self, surf):
+        get_cache()
+        start_workers(available_engines())
+        get_font_for_page(surface=surf, page_size=PAGE_SIZE, margin=MARGIN)
+
+    def _clear(self, surf):
+        surf.fill(BACKGROUND_COLOR)
+        pygame.display.update()
+
+    def _handle(self, req, conn):
+        if not isinstance(req['msg'], str):
+            raise ValueError("msg must be a string")
+        q = _Question(req, conn)
+        self.questions.put(q)
+        q.done.wait()
+        return q.reply
+
+    def _ask(self, surf, q):
+        req = q.req
+        engine = req.get('engine') or default_engine()
+        if engine not in available_engines():
+            logger.info("requested engine='{}' not available. using engine '{}' instead".format(engine, default_engine()))
+            engine = default_engine()
+        pygame.event.clear() # keys pressed before the question was shown don't answer it
+        is_yes = xask(req['msg'], req.get('yes'), req.get('no'), engine, surf)
+        self.asked += 1
+        return {'ok': True, 'yes': is_yes, 'rc': 0 if is_yes else 1}
+
+    def serve_forever(self):
+        """shows the questions in the calling (main) thread, as SDL wants it."""
+        self._server = JsonLineServer(self.sock_path, self._handle, 'xask kiosk').listen()
+        surf = _init_screen(fullscreen=self.fullscreen)
+        self._warm_up(surf)
+        self._clear(surf)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        try:
+            while True:
+                try:
+                    q = self.questions.get(timeout=INPUT_POLL_INTERVAL)
+                except queue.Empty:
+                    if any(event.type == QUIT for event in pygame.event.get()):
+                        break
+                    continue
+                if q.abandoned():
+                    q.reply = {'ok': False, 'error': 'client went away'}
+                    q.done.set()
+                    continue
+                try:
+                    q.reply = self._ask(surf, q)
+                except Exception as e:
+                    logger.error("xask kiosk: asking '{}' failed: {}".format(q.req['msg'], e))
+                    q.reply = {'ok': False, 'error': str(e)}
+                finally:
+                    self._clear(surf)
+                    q.done.set()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._server.close()
+            pygame.quit()
+
+
+def kiosk(sock_path=KIOSK_SOCKET):
+    """runs the xask kiosk in the foreground."""
+    import signal
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    XaskKiosk(sock_path).serve_forever()
+
+
+def _kiosk_request(req, sock_path=KIOSK_SOCKET):
+    """
+    sends req to the kiosk and returns its reply.
+    returns None if no kiosk is listening on sock_path.
+    """
+    return json_line_request(req, sock_path, 'xask kiosk')
+
+
 def main():
     kwargs = docopt(__doc__, version=str('.'.join([str(el) for el in __version__])))
     logger.debug("kwargs={}".format(kwargs))
+    sock_path = kwargs['--socket'] or KIOSK_SOCKET
+    if kwargs['--kiosk']:
+        kiosk(sock_path)
+        return True
     if '<msg>' in kwargs:
         msg = kwargs['<msg>']
     reply_y = kwargs['--yes']
@@ -376,14 +797,23 @@ def main():
     exec_n = kwargs['--no-exec']
     engine = kwargs['--engine']
     if not engine in available_engines():
-        engine=ENGINE_DEFAULT
+        engine=default_engine()
     if not msg:
         if _VERBOSITY > 0:
             msg = input("what should i say? : ")
         else:
             msg = input()
-    surf = _init_screen(fullscreen=FULLSCREEN)
-    is_yes = xask(msg,reply_y,reply_n,engine,surf,quit_if_done=False)
+    reply = None
+    if not kwargs['--no-kiosk']: # thin client: the kiosk asks
+        reply = _kiosk_request({'msg': msg, 'yes': reply_y, 'no': reply_n, 'engine': engine}, sock_path)
+        if reply is not None and not reply['ok']:
+            logger.critical(reply['error'])
+            sys.exit(2)
+    if reply is not None:
+        is_yes = reply['yes']
+    else:
+        surf = _init_screen(fullscreen=FULLSCREEN)
+        is_yes = xask(msg,reply_y,reply_n,engine,surf,quit_if_done=False)
     cmd=None
     if is_yes:
         if exec_y:
@@ -392,8 +822,8 @@ def main():
         if exec_n:
             cmd = exec_n
     if cmd:
-        logger.info("executing '{}'".format(exec_n))
-        subprocess.run(['{}'].format(cmd))
+        logger.info("executing '{}'".format(cmd))
+        subprocess.run(cmd, shell=True)
     return is_yes
 
 if __name__ == '__main__':
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+headless render benchmark of `xask`.
+
+drives _show_message() (char by char reveal, unthrottled) and word_wrap()
+(the whole page at once) over a matrix of message lengths, page sizes and
+window sizes on SDL's dummy video driver, without audio. reports histograms
+of the frame render times, time-to-first-frame and font fitting time, cold
+(empty font and glyph caches) and warm. combinations whose message doesn't
+fit onto the page are skipped.
+
+Usage:
+xask_bench.py [--lengths=<list>] [--page-sizes=<list>] [--window-sizes=<list>]
+              [--runs=<n>] [--output=<json>]
+
+Options:
+    --lengths=<list>       Comma separated message lengths (chars) [default: 30,120,480]
+    --page-sizes=<list>    Comma separated page sizes (columns x rows) [default: 20x6,40x12,80x24]
+    --window-sizes=<list>  Comma separated window sizes (pixels) [default: 640x480,1200x800,1920x1080]
+    --runs=<n>             Repetitions per combination, the first one cold [default: 3]
+    --output=<json>        Save the results into this file
+    -h, --help             Print this
+
+Examples:
+    $ ./xask_bench.py
+    $ ./xask_bench.py --lengths 1000 --page-sizes 80x24 --window-sizes 1920x1080 --output xask-bench.json
+"""
+import json
+import os
+import statistics
+import sys
+import time
+from docopt import docopt
+
+os.environ['SDL_VIDEODRIVER'] = 'dummy'
+os.environ['SDL_AUDIODRIVER'] = 'dummy'
+
+HISTOGRAM_BUCKETS = [0.25, 0.5, 1, 2, 4, 8, 16, 33, float('inf')] # upper bounds in ms
+WORDS = ("Do you want to play a game? Shall we play global thermonuclear war or "
+         "would you prefer a nice game of chess? ").split()
+
+
+def _sizes(arg):
+    return [tuple(int(v) for v in size.split('x')) for size in arg.split(',')]
+
+
+def message(length):
+    """returns a message of length chars made of words."""
+    words = []
+    while sum(len(w) + 1 for w in words) <= length:
+        words.append(WORDS[len(words) % len(WORDS)])
+    return ' '.join(words)[:length].rstrip() or WORDS[0][:length]
+
+
+def histogram(timings):
+    """returns [(upper bound ms, count), ...] of timings (seconds), the last bound is None (infinite)."""
+    counts = [0] * len(HISTOGRAM_BUCKETS)
+    for t in timings:
+        ms = t * 1000
+        for i, bound in enumerate(HISTOGRAM_BUCKETS):
+            if ms <= bound:
+                counts[i] += 1
+                break
+    return list(zip(HISTOGRAM_BUCKETS[:-1] + [None], counts))
+
+
+def _percentile(timings, p):
+    timings = sorted(timings)
+    return timings[min(len(timings) - 1, int(len(timings) * p))]
+
+
+def _reset_caches(xask):
+    xask._font_cache.clear()
+    xask._glyphs.glyphs.clear()
+    xask._glyphs.font = None
+    xask._layout = None
+
+
+def bench(xask, surf, text, page_size, runs):
+    """
+    shows text runs times. returns the measurements or None if text doesn't fit.
+    """
+    pygame = xask.pygame
+    xask.PAGE_SIZE = page_size
+    frame_times, ttff, font_fit, wrap = [], [], [], []
+    for i in range(runs):
+        if i == 0:
+            _reset_caches(xask)
+        xask._layout = None # lay out again, as for a new question
+        try:
+            xask._show_message(surf, text, show_cursor=True, wait_for_keypress=False)
+        except ValueError: # text too long for the page
+            return None
+        frame_times += xask.render_stats['frame_times']
+        ttff.append(xask.render_stats['ttff'])
+        font_fit.append(xask.render_stats['font_fit'])
+        font = xask.get_font_for_page(surface=surf, page_size=page_size, margin=xask.MARGIN)
+        s = time.perf_counter()
+        xask.word_wrap(surf, text, None, font, xask.TEXT_COLOR)
+        pygame.display.update()
+        wrap.append(time.perf_counter() - s)
+    return {'frames': len(frame_times),
+            'frame.median': statistics.median(frame_times), 'frame.p95': _percentile(frame_times, 0.95),
+            'frame.p99': _percentile(frame_times, 0.99), 'frame.max': max(frame_times),
+            'frame.histogram': histogram(frame_times),
+            'ttff.cold': ttff[0], 'ttff.warm': statistics.median(ttff[1:] or ttff),
+            'font_fit.cold': font_fit[0], 'font_fit.warm': statistics.median(font_fit[1:] or font_fit),
+            'word_wrap.median': statistics.median(wrap)}
+
+
+def main():
+    kwargs = docopt(__doc__)
+    runs = int(kwargs['--runs'])
+    import say
+    import xask
+    xask.logger.setLevel('WARNING')
+    xask.FONT_CACHE_PERSIST = False # cold means cold
+    xask.TRANSITION_FPS = float('inf') # reveal chars back to back, frame times exclude waiting anyway
+    results = []
+    for window_size in _sizes(kwargs['--window-sizes']):
+        xask.WINDOW_SIZE = window_size
+        surf = xask._init_screen(fullscreen=False)
+        for page_size in _sizes(kwargs['--page-sizes']):
+            for length in [int(n) for n in kwargs['--lengths'].split(',')]:
+                r = bench(xask, surf, message(length), page_size, runs)
+                name = "{}x{} page {}x{} {:>5} chars".format(*window_size, *page_size, length)
+                if r is None:
+                    print("{:<40} skipped, doesn't fit".format(name))
+                    continue
+                results.append(dict(r, window_size=window_size, page_size=page_size, length=length))
+                print("{:<40} frame median {:6.3f} p95 {:6.3f} p99 {:6.3f} max {:6.3f} ms  "
+                      "ttff cold {:7.2f} warm {:6.2f} ms  font fit cold {:6.2f} ms  word_wrap {:6.2f} ms".format(
+                          name, r['frame.median'] * 1000, r['frame.p95'] * 1000, r['frame.p99'] * 1000,
+                          r['frame.max'] * 1000, r['ttff.cold'] * 1000, r['ttff.warm'] * 1000,
+                          r['font_fit.cold'] * 1000, r['word_wrap.median'] * 1000))
+                print("{:<40} {}".format('', '  '.join(("<={:g}ms:{}" if b else ">{:g}ms:{}").format(b or HISTOGRAM_BUCKETS[-2], c) for b, c in r['frame.histogram'] if c)))
+    xask.pygame.quit()
+    if kwargs['--output']:
+        meta = {'version': '.'.join(str(v) for v in say.__version__), 'time': time.time(),
+                'runs': runs, 'pygame': xask.pygame.version.ver, 'sdl': '.'.join(str(v) for v in xask.pygame.get_sdl_version())}
+        with open(kwargs['--output'], 'w') as fh:
+            json.dump({'meta': meta, 'results': results}, fh, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())